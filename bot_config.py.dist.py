@@ -3,9 +3,44 @@ BOTNAME = 'botname'
 PASSWORD = 'supersecurepassword'
 
 MENSA_ROOM = 'mensa'
+# The menu of the day is posted to these rooms at MENSA_BROADCAST_TIME (HH:MM) on MENSA_BROADCAST_WEEKDAYS (0 = monday)
+MENSA_BROADCAST_ROOMS = ()  # e.g. ('mensa', 'general')
+MENSA_BROADCAST_TIME = '10:30'
+MENSA_BROADCAST_WEEKDAYS = [0, 1, 2, 3, 4]
 MENSA_CACHE_URL = 'https://infomonitor.somewhere.com/json/mensa/'
 
 DMS_TOKEN = 'no token'
 POLL_STATUS_ROOM = ''
 
 SENTRY_URL = None
+
+# Number of worker processes. With more than one worker the rooms are distributed among them
+WORKERS = 1
+
+# Seconds to finish running commands on shutdown. Should be less than the stop timeout of docker (10s)
+DRAIN_TIMEOUT = 8
+# Seconds of DRAIN_TIMEOUT reserved for the shutdown hooks (cache snapshot, pending messages, kafka spool)
+DRAIN_HOOK_TIME = 3
+# Caches are written to this file periodically and on shutdown and loaded on start
+SNAPSHOT_FILE = 'cache.snapshot'
+# Seconds between two snapshots
+SNAPSHOT_INTERVAL = 300
+# Snapshots older than this (in seconds) are ignored on start
+SNAPSHOT_MAX_AGE = 86400
+
+# Poll updates which could not be sent to kafka yet are kept in this file and replayed in order
+KAFKA_SPOOL_FILE = 'kafka.spool'
+# Max. number of poll updates waiting in memory. Further updates go to the spool file
+KAFKA_QUEUE_SIZE = 100
+
+# Per user throttle of expensive commands: command -> (max. number of requests, window in seconds)
+THROTTLE = {
+    'birthday': (2, 300),
+    'dms': (20, 60),
+    'food': (10, 60),
+}
+
+# Tracing of incoming messages: Path of a JSONL file or url of an OTLP/HTTP collector (None = disabled)
+TRACE_EXPORT = None
+# Share of the messages which are traced
+TRACE_SAMPLE_RATE = 0.1
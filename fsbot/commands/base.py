@@ -0,0 +1,50 @@
+import math
+from typing import Any, Awaitable, Callable, Optional
+
+import rocketbot.commands as c
+import rocketbot.models as m
+
+import fsbot.utils.executor as ex
+import fsbot.utils.sendqueue as sq
+import fsbot.utils.throttle as th
+
+
+class BaseCommand(c.BaseCommand):
+    """Base class of all fsbot commands
+
+    Messages are sent via the outbound send queue which is shared by all
+    commands if passed in. Otherwise each command uses its own queue.
+
+    Expensive commands can be throttled per user by passing a throttle.
+    CPU bound work is run by the executor.
+    """
+    def __init__(
+            self, *,
+            sendqueue: Optional[sq.SendQueue] = None,
+            throttle: Optional[th.Throttle] = None,
+            executor: ex.Executor = ex.default,
+            **kwargs: Any):
+        super().__init__(**kwargs)
+        self.sendqueue = sendqueue if sendqueue is not None else sq.SendQueue(self.master)
+        self.throttle = throttle
+        self.executor = executor
+
+    async def throttled(
+            self, command: str, args: str, message: m.Message,
+            func: Callable[[], Awaitable[None]],
+            deduplicate: bool = True) -> None:
+        """Run the handler `func` unless the user exceeds the throttle of this command
+
+        Set `deduplicate` to False for requests which must not be merged with an
+        identical running request (e.g. orders).
+        """
+        if self.throttle is None:
+            await func()
+            return
+
+        key = (message.created_by.username, message.roomid, command, args.strip().lower())
+        retry_in = await self.throttle.run(message.created_by.username, key, func, deduplicate)
+        if retry_in is not None:
+            await self.sendqueue.send_message(
+                message.roomid,
+                f'Too many requests. Please try again in {math.ceil(retry_in)}s.')
@@ -1,11 +1,19 @@
+import functools
 import re
-from typing import List, Tuple
+from typing import Any, List, Tuple
 
-import rocketbot.commands as c
 import rocketbot.models as m
 
+import fsbot.utils.tracing as tracing
+from fsbot.commands.base import BaseCommand
+from fsbot.utils.users import UserDirectory
+
+
+class Birthday(BaseCommand):
+    def __init__(self, users: UserDirectory, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.users = users
 
-class Birthday(c.BaseCommand):
     def usage(self) -> List[Tuple[str, str]]:
         return [
             ('birthday @user', 'Create a private group with all user except the mentioned one'),
@@ -21,25 +29,41 @@ class Birthday(c.BaseCommand):
         """
         if command == 'birthday':
             if len(message.mentions) == 0:
-                await self.master.ddp.send_message(message.roomid, "Please mention a user with `@user`")
+                await self.sendqueue.send_message(message.roomid, "Please mention a user with `@user`")
                 return
 
             user = message.mentions[0]
             if user.username == message.created_by.username:
-                await self.master.ddp.send_message(message.roomid, "Please mention someone other than yourself")
+                await self.sendqueue.send_message(message.roomid, "Please mention someone other than yourself")
+                return
+            if len(self.users) == 0:
+                # Not seeded yet, the group would be created without members
+                await self.sendqueue.send_message(
+                    message.roomid, "The user list is not loaded yet. Please try again later")
+                return
+            if user.username not in self.users:
+                await self.sendqueue.send_message(message.roomid, f"Unknown user @{user.username}")
                 return
 
-            result = await self.master.rest.users_list(count=0)
-            users = [m.create(m.User, u) for u in result.json()['users']]
+            await self.throttled(command, args, message, functools.partial(self._create_group, user, message))
 
-            username = user.name if user.name is not None else user.username
-            username = re.sub(r'\s', '_', username).lower()
-            name = f'geburtstag_{username}'
-            members = [u.username for u in users if u.username != user.username]
+    async def _create_group(self, user: m.UserRef, message: m.Message) -> None:
+        """Create the private group with all users except the mentioned one"""
+        # Inactive users are members as well
+        usernames = self.users.usernames(active_only=False)
+        username = user.name if user.name is not None else user.username
+        username = re.sub(r'\s', '_', username).lower()
+        name = f'geburtstag_{username}'
+        members = await self.executor.run('users', len(usernames), _members, usernames, user.username)
+        with tracing.span('rest.groups_create', members=len(members)):
             result = await self.master.rest.groups_create(name=name, members=members)
 
-            if result.status_code != 200:
-                await self.master.ddp.send_message(message.roomid, result.json()['error'])
-                return
-            room = m.create(m.Room, result.json()['group'])
-            await self.master.rest.groups_add_owner(room_id=room._id, user_id=message.created_by._id)
+        if result.status_code != 200:
+            await self.sendqueue.send_message(message.roomid, result.json()['error'])
+            return
+        room = m.create(m.Room, result.json()['group'])
+        await self.master.rest.groups_add_owner(room_id=room._id, user_id=message.created_by._id)
+
+
+def _members(usernames: List[str], excluded: str) -> List[str]:
+    return [u for u in usernames if u != excluded]
@@ -1,17 +1,44 @@
 import asyncio
+import functools
 import os
 import re
-from typing import Any, List, Tuple
+from typing import Any, Awaitable, Callable, List, Tuple
 
 import dmsclient as dms
-import rocketbot.commands as c
 import rocketbot.models as m
 
+import fsbot.utils.tracing as tracing
+from fsbot.commands.base import BaseCommand
 
-class Dms(c.BaseCommand):
-    def __init__(self, token: str, **kwargs: Any):
+# Runs the dms client with the given arguments and returns its output
+Runner = Callable[[List[str]], Awaitable[bytes]]
+
+
+def create_config_if_missing(token: str) -> None:
+    """Write the config of the dms client (used by `run_dms`) unless it exists"""
+    rcfile = os.path.expanduser('~/.dmsrc')
+    config = dms.DmsConfig()
+    status = config.read(rcfile)
+    if status == dms.ReadStatus.NOT_FOUND:
+        config._set(dms.Sec.GENERAL, 'token', token)
+        config.write(rcfile)
+
+
+async def run_dms(argv: List[str]) -> bytes:
+    """Run the dms client in a subprocess"""
+    proc = await asyncio.create_subprocess_exec(
+        'dms', *argv,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    await proc.wait()
+    if proc.stdout:
+        return await proc.stdout.read()
+    return b''
+
+
+class Dms(BaseCommand):
+    def __init__(self, runner: Runner = run_dms, **kwargs: Any):
         super().__init__(**kwargs)
-        self._create_dmsclient_config_if_missing(token)
+        self.runner = runner
 
     def usage(self) -> List[Tuple[str, str]]:
         return [
@@ -41,21 +68,20 @@ class Dms(c.BaseCommand):
             if '--force' not in argv:
                 argv.append('--force')
 
-        proc = await asyncio.create_subprocess_exec(
-            'dms', *argv,
-            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
-        await proc.wait()
-        if proc.stdout:
-            dms_result = await proc.stdout.read()
-            result_str = dms_result.decode('utf-8')
-        else:
-            result_str = "Done."
-        await self.master.ddp.send_message(message.roomid, result_str)
-
-    def _create_dmsclient_config_if_missing(self, token: str) -> None:
-        rcfile = os.path.expanduser('~/.dmsrc')
-        config = dms.DmsConfig()
-        status = config.read(rcfile)
-        if status == dms.ReadStatus.NOT_FOUND:
-            config._set(dms.Sec.GENERAL, 'token', token)
-            config.write(rcfile)
+        # Orders must not be merged with an identical order which is still running
+        deduplicate = argv[0] not in ('order', 'buy', 'comment')
+        await self.throttled(
+            command, args, message, functools.partial(self._run_dms, argv, message.roomid), deduplicate)
+
+    async def _run_dms(self, argv: List[str], roomid: str) -> None:
+        with tracing.span('dms.subprocess', subcommand=argv[0]):
+            dms_result = await self.runner(argv)
+            if dms_result:
+                result_str = await self.executor.run('dms', len(dms_result), _decode, dms_result)
+            else:
+                result_str = "Done."
+        await self.sendqueue.send_message(roomid, result_str)
+
+
+def _decode(data: bytes) -> str:
+    return data.decode('utf-8')
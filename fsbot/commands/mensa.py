@@ -1,15 +1,20 @@
 import datetime
+import functools
 import logging
 import re
 from typing import Any, Awaitable, Callable, Coroutine, List, Optional, Tuple
 
-import rocketbot.commands as c
 import rocketbot.models as m
 import rocketbot.utils.poll as pollutil
 import rocketbot.utils.sentry as sentry
-from ftfbroker.producer.rocketchat_mensa import RocketchatMensaProducer
 
+import fsbot.utils.executor as ex
 import fsbot.utils.meals as meals
+import fsbot.utils.publisher as pub
+import fsbot.utils.sendqueue as sq
+import fsbot.utils.tracing as tracing
+from fsbot.commands.base import BaseCommand
+from fsbot.utils.models import OptionVotes
 
 logger = logging.getLogger(__name__)
 
@@ -19,48 +24,119 @@ DEFAULT_TIME = {
 }
 
 
-async def _food_msg_by_day(day: int) -> str:
-    """Return the food msg by day where monday=0, ..."""
-    offset = (day - datetime.datetime.today().weekday()) % 7
-    return await meals.get_food(offset, 1)
+# Aliases resolving to a day relative to today: alias -> offset
+_DAY_ALIASES = {
+    alias: offset
+    for offset, aliases in enumerate([
+        ['heute', 'today', "aujourd'hui"],
+        ['morgen', 'tomorrow', 'demain'],
+        ['übermorgen', 'uebermorgen', 'overmorrow', 'après-demain'],
+    ])
+    for alias in aliases
+}
+
+# Aliases resolving to a weekday: alias -> weekday (monday=0)
+_WEEKDAY_ALIASES = {
+    alias: weekday
+    for weekday, aliases in enumerate([
+        ['montag', 'mo', 'monday', 'mon', 'lundi', 'lun'],
+        ['dienstag', 'di', 'tuesday', 'tue', 'mardi', 'mar'],
+        ['mittwoch', 'mi', 'wednesday', 'wed', 'mercredi', 'mer'],
+        ['donnerstag', 'do', 'thursday', 'thu', 'jeudi', 'jeu'],
+        ['freitag', 'fr', 'friday', 'fri', 'vendredi', 'ven'],
+        ['samstag', 'sa', 'saturday', 'sat', 'samedi', 'sam'],
+        ['sonntag', 'so', 'sunday', 'sun', 'dimanche', 'dim'],
+    ])
+    for alias in aliases
+}
+
+# Aliases resolving to a working week: alias -> number of weeks from the current one
+_WEEK_ALIASES = {
+    alias: weeks
+    for weeks, aliases in enumerate([
+        ['woche', 'diese woche', 'week', 'this week', 'semaine', 'cette semaine'],
+        ['nächste woche', 'naechste woche', 'next week', 'semaine prochaine'],
+    ])
+    for alias in aliases
+}
 
+_range_pattern = re.compile(r'^(.+?)\s*(?:-|\sbis\s|\sto\s)\s*(.+)$')
+
+
+def _day_offset(alias: str, today: int, start: int = 0) -> Optional[int]:
+    """Offset (in days from today) of a single day alias
+
+    Weekdays resolve to their next occurrence on or after the day with offset `start`
+    """
+    if alias in _DAY_ALIASES:
+        return _DAY_ALIASES[alias]
+    if alias in _WEEKDAY_ALIASES:
+        return start + (_WEEKDAY_ALIASES[alias] - today - start) % 7
+    return None
 
-async def _food_command(args: str) -> Optional[str]:
-    """Reply with the meals of the specified day
+
+def _parse_food_args(args: str, today: int) -> Optional[Tuple[int, int]]:
+    """Resolve the arguments of the food command to a range of days
+
+    Returns a tuple (offset, num_days) as expected by `meals.get_food` or None
+    if the arguments are unknown. `today` is the weekday of today (monday=0).
+    """
+    args = ' '.join(args.lower().split())
+    if len(args) == 0:
+        return (0, 1)
+    if args.isnumeric():
+        return (0, int(args))
+    if args in _WEEK_ALIASES:
+        weeks = _WEEK_ALIASES[args]
+        if weeks == 0:
+            if today >= 5:
+                # On the weekend the coming working week is meant
+                return (7 - today, 5)
+            # Remaining working days of this week (at least today)
+            return (0, 5 - today)
+        return (7 * weeks - today, 5)
+
+    offset = _day_offset(args, today)
+    if offset is not None:
+        return (offset, 1)
+
+    res = _range_pattern.match(args)
+    if res:
+        first, last = res.groups()
+        start = _day_offset(first, today)
+        if start is not None:
+            end = _day_offset(last, today, start)
+            if end is not None and end >= start:
+                return (start, end - start + 1)
+    return None
+
+
+async def _food_command(
+        args: str, meals_provider: meals.MealsProvider, executor: ex.Executor = ex.default) -> Optional[str]:
+    """Reply with the meals of the specified days
 
     Possible arguments:
     - empty args -> show meal of today
     - args = n in [1..x]  show meals of n future days
-    - args = 'heute', 'morgen', 'montag', ...
+    - args = 'heute', 'morgen', 'montag', 'mo', 'nächste woche', ...
+    - args = 'mo-mi', 'heute bis freitag', ...
     """
-    args = args.strip().lower()
-    if args.isnumeric():
-        foodmsg = await meals.get_food(0, int(args))
-    elif len(args) == 0 or args in ['heute', 'today']:
-        foodmsg = await meals.get_food(0, 1)
-    elif args in ['morgen', 'tomorrow']:
-        foodmsg = await meals.get_food(1, 1)
-    elif args in ['montag', 'monday']:
-        foodmsg = await _food_msg_by_day(0)
-    elif args in ['dienstag', 'tuesday']:
-        foodmsg = await _food_msg_by_day(1)
-    elif args in ['mittwoch', 'wednesday']:
-        foodmsg = await _food_msg_by_day(2)
-    elif args in ['donnerstag', 'thursday']:
-        foodmsg = await _food_msg_by_day(3)
-    elif args in ['freitag', 'friday']:
-        foodmsg = await _food_msg_by_day(4)
-    else:
+    day_range = _parse_food_args(args, datetime.date.today().weekday())
+    if day_range is None:
         return None
-    return foodmsg
+    return await meals_provider.get_food(*day_range, executor=executor)
+
 
+class Food(BaseCommand):
+    def __init__(self, meals_provider: meals.MealsProvider, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.meals_provider = meals_provider
 
-class Food(c.BaseCommand):
     def usage(self) -> List[Tuple[str, str]]:
         return [
             (
-                '<essen | food> [ <n | today | tomorrow | monday .. friday> ]',
-                'Show meals of the day, of the next "n" days or on a specific day'
+                '<essen | food> [ <n | today | tomorrow | monday .. friday | next week | mo-mi> ]',
+                'Show meals of the day, of the next "n" days, on a specific day or a range of days'
             ),
         ]
 
@@ -73,20 +149,27 @@ class Food(c.BaseCommand):
         """Handle the incoming message
         """
         if command in ['essen', 'food']:
-            msg = await _food_command(args)
-            if msg is None:
-                com, desc = self.usage()[0]
-                await self.master.ddp.send_message(
-                    message.roomid,
-                    f'*Usage:*\n```{com}\n    {desc}```')
-            else:
-                await self.master.ddp.send_message(message.roomid, msg)
-
-
-class Etm(c.BaseCommand):
-    def __init__(self, pollmanager: pollutil.PollManager, **kwargs: Any):
+            await self.throttled(command, args, message, functools.partial(self._send_food, args, message.roomid))
+
+    async def _send_food(self, args: str, roomid: str) -> None:
+        msg = await _food_command(args, self.meals_provider, self.executor)
+        if msg is None:
+            com, desc = self.usage()[0]
+            await self.sendqueue.send_message(
+                roomid,
+                f'*Usage:*\n```{com}\n    {desc}```')
+        else:
+            await self.sendqueue.send_message(roomid, msg)
+
+
+class Etm(BaseCommand):
+    def __init__(
+            self, pollmanager: pollutil.PollManager, meals_provider: meals.MealsProvider,
+            publisher: pub.KafkaPublisher, **kwargs: Any):
         super().__init__(**kwargs)
         self.pollmanager = pollmanager
+        self.meals_provider = meals_provider
+        self.publisher = publisher
 
     def usage(self) -> List[Tuple[str, str]]:
         return [
@@ -123,25 +206,46 @@ class Etm(c.BaseCommand):
 
             if poll and poll.title == 'ETM' and poll.created_on.is_today():
                 # If its the same day, add the options to the poll
-                new_options = [
-                    await poll.add_option(option_txt)
-                    for option_txt in poll_options
-                    if option_txt.strip() != '']
-                if any(new_options):
+                new_options = await self._add_options(poll, poll_options)
+                if new_options:
                     # Preset sender of message for each option (s)he added
                     for opt in new_options:
-                        if opt is not None:
-                            opt.users.add(message.created_by.username)
-                    poll.options.sort(key=lambda x: x.text)
-                    await poll.resend_old_message(self.master)
+                        opt.users.add(message.created_by.username)
+                    # A single in-place update for all options added by this command
+                    await self.sendqueue.submit(message.roomid, functools.partial(poll.resend_old_message, self.master))
             else:
-                msg = await _food_command("")
+                msg = await _food_command("", self.meals_provider, self.executor)
                 if msg is not None:
-                    await self.master.ddp.send_message(message.roomid, msg)
-                poll = await self.pollmanager.create(message.roomid, message.id, 'ETM', poll_options)
+                    await self.sendqueue.send_message(message.roomid, msg)
+                poll_options = sorted(poll_options, key=_option_key)
+                poll = await self.sendqueue.submit(
+                    message.roomid,
+                    functools.partial(self.pollmanager.create, message.roomid, message.id, 'ETM', poll_options),
+                    priority=sq.Priority.REPLY)
                 # Ignore due to mypy bug: https://github.com/python/mypy/issues/2427
                 # poll.resend_old_message = monkeypatch_kafka(poll, poll.resend_old_message)  # type: ignore
-                setattr(poll, "resend_old_message", monkeypatch_kafka(poll, poll.resend_old_message))
+                setattr(
+                    poll, "resend_old_message", monkeypatch_kafka(poll, poll.resend_old_message, self.publisher))
+
+    @staticmethod
+    async def _add_options(poll: pollutil.Poll, option_txts: List[str]) -> List[pollutil.PollOption]:
+        """Add the options to the poll and keep the poll options ordered by time
+
+        Polls of older versions are ordered by text, so all options are sorted
+        once after adding. The existing and the new options are sorted runs
+        which the sort merges in linear time.
+        """
+        new_options = []
+        for option_txt in option_txts:
+            if option_txt.strip() == '':
+                continue
+            # Poll.add_option checks for duplicates, assigns the emoji and appends the option (no I/O)
+            option = await poll.add_option(option_txt)
+            if option is not None:
+                new_options.append(option)
+        if new_options:
+            poll.options.sort(key=lambda o: _option_key(o.text))
+        return new_options
 
     pattern = re.compile(r'^[\s]*(1[1-4])[.:]?([0-5][0-9])?[\s]*$')
 
@@ -163,30 +267,49 @@ class Etm(c.BaseCommand):
         return option
 
 
+_time_pattern = re.compile(r'^([0-9]{1,2}):([0-5][0-9])$')
+
+
+def _option_key(option: str) -> Tuple[int, int, str]:
+    """Sort key of a poll option
+
+    Normalized times (e.g. 9:30, 12:00) are ordered by time of day and
+    precede all other options which are ordered by text
+    """
+    res = _time_pattern.match(option.strip())
+    if res:
+        hours, minutes = res.groups()
+        return (0, int(hours) * 60 + int(minutes), '')
+    return (1, 0, option)
+
+
 def monkeypatch_kafka(
     poll: pollutil.Poll,
-    trigger: Callable[..., Awaitable[None]]
+    trigger: Callable[..., Awaitable[None]],
+    publisher: pub.KafkaPublisher,
 ) -> Callable[..., Coroutine[Any, Any, None]]:
 
     # Poll was created -> send first message
-    send_kafka_message(poll.options, poll.botname)
+    send_kafka_message(poll.options, poll.botname, publisher)
 
     async def wrapper(*args: Any, **kwargs: Any) -> None:
         # Call patched function first
         await trigger(*args, **kwargs)
         # Send kafka message on each trigger function call
-        send_kafka_message(poll.options, poll.botname)
+        send_kafka_message(poll.options, poll.botname, publisher)
 
     return wrapper
 
 
-def send_kafka_message(options: List[pollutil.PollOption], botname: str) -> None:
-    try:
-        kafkaproducer = RocketchatMensaProducer()
+def send_kafka_message(options: List[pollutil.PollOption], botname: str, publisher: pub.KafkaPublisher) -> None:
+    """Queue the current state of the poll. It is sent in the background
 
-        opts = [(o.text, [u for u in o.users if u != botname]) for o in options]
-        kafkaproducer.sendV1(opts)
-        kafkaproducer.close()
+    The poll changes until the update is sent, so the votes are copied once
+    (see `OptionVotes`). The publisher keeps them as they are.
+    """
+    try:
+        with tracing.span('kafka.publish', options=len(options)):
+            publisher.publish([OptionVotes.from_option(o, exclude=botname).as_tuple() for o in options])
     except Exception as e:
         logger.error(f"{type(e).__name__}: {e}", exc_info=True)
         sentry.exception()
@@ -0,0 +1,68 @@
+"""Scheduled posting of the daily menu to many rooms"""
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Collection, Sequence
+
+import rocketbot.master as master
+import rocketbot.utils.sentry as sentry
+
+import fsbot.utils.executor as ex
+import fsbot.utils.meals as meals
+import fsbot.utils.metrics as metrics
+import fsbot.utils.sendqueue as sq
+import fsbot.utils.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+
+async def broadcast_menu(
+        masterbot: master.Master, sendqueue: sq.SendQueue, meals_provider: meals.MealsProvider,
+        rooms: Sequence[str], executor: ex.Executor = ex.default) -> int:
+    """Post today's menu to all rooms (by name). Returns the number of rooms the menu was posted to
+
+    The menu is fetched and rendered once (and cached for the `essen`/`etm` commands).
+    The messages go through the send queue, so the pass stays within the rate limit.
+    """
+    with tracing.trace('broadcast', rooms=len(rooms)):
+        msg = await meals_provider.get_food(0, 1, executor)
+        if meals.NO_MEALS in msg:
+            logger.info("No menu to broadcast today")
+            return 0
+
+        results = await asyncio.gather(*[masterbot.room(room_name=r) for r in rooms], return_exceptions=True)
+        roomids = []
+        for name, result in zip(rooms, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Cannot broadcast the menu to {name}: {result}")
+            else:
+                roomids.append(result._id)
+
+        await asyncio.gather(*[sendqueue.send_message(r, msg, priority=sq.Priority.UPDATE) for r in roomids])
+    metrics.inc('broadcast.rooms', len(roomids))
+    logger.info(f"Menu posted to {len(roomids)} rooms")
+    return len(roomids)
+
+
+def next_run(now: datetime.datetime, at: datetime.time, weekdays: Collection[int]) -> datetime.datetime:
+    """Next point in time at `at` on one of the `weekdays` (0 = monday) after `now`"""
+    day = now.date()
+    for offset in range(8):
+        candidate = datetime.datetime.combine(day + datetime.timedelta(days=offset), at)
+        if candidate > now and candidate.weekday() in weekdays:
+            return candidate
+    raise ValueError('No weekday given')
+
+
+async def run_daily(at: datetime.time, weekdays: Collection[int], func: Callable[[], Awaitable[object]]) -> None:
+    """Call `func` every day at the given time (local time) on the given weekdays"""
+    while True:
+        now = datetime.datetime.now()
+        await asyncio.sleep((next_run(now, at, weekdays) - now).total_seconds())
+        try:
+            await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"{type(e).__name__}: {e}", exc_info=True)
+            sentry.exception()
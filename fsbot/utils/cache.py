@@ -0,0 +1,32 @@
+import time
+from typing import Any, Hashable, MutableMapping, Optional, Tuple
+
+
+class TTLCache:
+    """Cache whose entries expire after `ttl` seconds
+
+    The entries are kept in `store` which can be any mutable mapping, e.g. a
+    dict proxy of a multiprocessing manager to share the cache between processes.
+    Keys and values therefore have to be picklable.
+    """
+    def __init__(self, ttl: float, store: Optional[MutableMapping[Hashable, Tuple[float, Any]]] = None):
+        self.ttl = ttl
+        self.store: MutableMapping[Hashable, Tuple[float, Any]] = store if store is not None else {}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.time():
+            self.store.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self.store[key] = (time.time() + self.ttl, value)
+
+    def bind(self, store: MutableMapping[Hashable, Tuple[float, Any]]) -> None:
+        """Replace the store, e.g. by a store shared between processes"""
+        store.update(self.store)
+        self.store = store
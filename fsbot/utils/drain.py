@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import signal
+from typing import Any, Awaitable, Callable, Coroutine, List, Optional
+
+import rocketbot.bots.base as b
+import rocketbot.master as master
+import rocketbot.models as m
+
+logger = logging.getLogger(__name__)
+
+
+class Drain:
+    """Graceful shutdown of the bot on SIGTERM and SIGINT
+
+    1. Stop accepting new messages
+    2. Wait for the running handlers, but at most until `hook_time` seconds before the deadline
+    3. Run the hooks in order (e.g. write cache snapshots, flush outbound queues) until the deadline
+    4. Cancel the background tasks
+    5. Logout and disconnect
+    """
+    def __init__(self, masterbot: master.Master, deadline: float, hook_time: float = 0):
+        self.master = masterbot
+        self.deadline = deadline
+        self.hook_time = hook_time
+        self.draining = False
+        self._hooks: List[Callable[[], Awaitable[None]]] = []
+        self._tasks: List['asyncio.Task[Any]'] = []
+        self._shutdown: Optional['asyncio.Task[None]'] = None
+
+    def add_hook(self, hook: Callable[[], Awaitable[None]]) -> None:
+        """Add a hook which is run after the handlers finished"""
+        self._hooks.append(hook)
+
+    def run_in_background(self, coro: Coroutine[Any, Any, Any]) -> 'asyncio.Task[Any]':
+        """Run a background task (e.g. a periodic job) until the shutdown
+
+        The task is referenced until it is done and a failure is logged.
+        """
+        task = asyncio.get_event_loop().create_task(coro)
+        self._tasks.append(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task: 'asyncio.Task[Any]') -> None:
+        self._tasks.remove(task)
+        if not task.cancelled() and task.exception() is not None:
+            e = task.exception()
+            logger.error(f"Background task failed: {type(e).__name__}: {e}", exc_info=e)
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Replace the signal handlers of the master and guard all its bots"""
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._on_signal, sig)
+        for bot in self.master.bots:
+            self._guard(bot)
+
+    async def _run_hooks(self) -> None:
+        for hook in self._hooks:
+            try:
+                await hook()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Shutdown hook failed: {type(e).__name__}: {e}", exc_info=True)
+
+    def _on_signal(self, sig: signal.Signals) -> None:
+        # Not a background task because the shutdown cancels those
+        if self._shutdown is None:
+            self._shutdown = asyncio.get_event_loop().create_task(self.shutdown(sig))
+
+    def _guard(self, bot: b.BaseBot) -> None:
+        handle = bot.handle
+
+        async def _handle(message: m.Message) -> None:
+            if self.draining:
+                logger.debug(f"Ignore message {message.id} while draining")
+                return
+            await handle(message)
+
+        setattr(bot, 'handle', _handle)
+
+    async def shutdown(self, sig: signal.Signals) -> None:
+        if self.draining:
+            return
+        logger.info(f"{sig.name} received. Draining within {self.deadline}s")
+        self.draining = True
+
+        loop = asyncio.get_event_loop()
+        end = loop.time() + self.deadline
+        try:
+            await asyncio.wait_for(self.master.finish_all_tasks(), max(self.deadline - self.hook_time, 0))
+        except asyncio.TimeoutError:
+            logger.warning("Deadline exceeded. Stop waiting for running handlers")
+
+        # The deadline is a hard limit (e.g. the stop timeout of docker), so a slow hook cuts off the later ones
+        try:
+            await asyncio.wait_for(self._run_hooks(), max(end - loop.time(), 0))
+        except asyncio.TimeoutError:
+            logger.warning("Deadline exceeded. Skip the remaining shutdown hooks")
+
+        for task in list(self._tasks):
+            task.cancel()
+        await self.master.shutdown()
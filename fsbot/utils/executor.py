@@ -0,0 +1,65 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import fsbot.utils.metrics as metrics
+
+T = TypeVar('T')
+
+# Minimum size of the work (kind -> number of items/ bytes) to run it in the pool
+DEFAULT_THRESHOLDS = {
+    'menu': 14,  # days
+    'users': 1000,  # users
+    'dms': 100000,  # bytes
+}
+
+
+class Executor:
+    """Runs CPU bound work of the commands in a pool instead of the event loop thread
+
+    Small work is run directly because the overhead of the pool would exceed
+    the work itself. Therefore each call specifies the kind and size of the work.
+    The default pool of the event loop is used if no pool is given. `pools`
+    overrides the pool per kind, e.g. a process pool for pure python work
+    which would hold the GIL in a thread (the function and its arguments have
+    to be picklable then).
+    """
+    def __init__(
+            self, pool: Optional[concurrent.futures.Executor] = None,
+            thresholds: Dict[str, int] = DEFAULT_THRESHOLDS,
+            pools: Dict[str, concurrent.futures.Executor] = {}):
+        self.pool = pool
+        self.thresholds = thresholds
+        self.pools = pools
+        self._pending = 0
+
+    async def run(self, kind: str, size: int, func: Callable[..., T], *args: Any) -> T:
+        """Run `func(*args)` in the pool if the size exceeds the threshold of the kind"""
+        if size < self.thresholds.get(kind, 0):
+            metrics.inc(f'executor.{kind}.inline')
+            return func(*args)
+
+        self._pending += 1
+        metrics.gauge('executor.pending', self._pending)
+        metrics.inc(f'executor.{kind}.offloaded')
+        try:
+            result, seconds = await asyncio.get_event_loop().run_in_executor(
+                self.pools.get(kind, self.pool), functools.partial(_timed, func, *args))
+            metrics.observe(f'executor.{kind}.seconds', seconds)
+            return result
+        finally:
+            self._pending -= 1
+            metrics.gauge('executor.pending', self._pending)
+
+
+# Executor using the default pool of the event loop
+default = Executor()
+
+
+def _timed(func: Callable[..., T], *args: Any) -> Tuple[T, float]:
+    """Run the function and measure the execution time (also works in other processes)"""
+    start = time.monotonic()
+    result = func(*args)
+    return result, time.monotonic() - start
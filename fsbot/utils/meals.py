@@ -1,34 +1,227 @@
+import codecs
+import datetime
+import json
+import logging
+from typing import Any, Dict, List, Tuple
+
 import aiohttp
 
-import bot_config as c
+import fsbot.utils.executor as ex
+import fsbot.utils.metrics as metrics
+import fsbot.utils.tracing as tracing
+from fsbot.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Max. size (decoded) of a response. Larger responses are cut off
+MAX_PAYLOAD_SIZE = 1024 * 1024
+CHUNK_SIZE = 16 * 1024
+
+# Rendered menus by (date, offset, num_meals)
+cache = TTLCache(ttl=600)
+
+# Last response by url: (etag, last modified, parsed data, size of the body)
+# Used for conditional requests, so an unchanged menu is neither downloaded nor parsed again
+responses = TTLCache(ttl=86400)
+
+# Text of a menu without meals
+NO_MEALS = 'No meals received.'
+
+
+class MealsProvider:
+    """Menus of the mensa cache at `base_url`
+
+    By default the module caches are used, which are part of the cache snapshot.
+    """
+    def __init__(self, base_url: str, cache: TTLCache = cache, responses: TTLCache = responses):
+        self.base_url = base_url
+        self.cache = cache
+        self.responses = responses
+
+    async def get_food(self, offset: int, num_meals: int, executor: ex.Executor = ex.default) -> str:
+        """Get the food which will be served
+
+        Offset defines the first meal which will be in the result
+        offset = 0 -> today
+        offset = 1 -> tomorrow
+
+        Num_meals defines the number of meals which will be in the result
+
+        Examles:
+        Food for today -> get_food(0, 1)
+        Food for the week -> get_food(0, 7)
+        Food for tomorrow and the day after -> get_food(1, 2)
+
+        The menu is rendered by the given executor
+        """
+        key = (datetime.date.today().isoformat(), offset, num_meals)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return str(cached)
+
+        url1 = self.base_url + '/' + str(offset)
+        url2 = self.base_url + '/' + str(offset + num_meals)
 
+        with tracing.span('mensa.fetch', offset=offset, num_meals=num_meals):
+            async with aiohttp.ClientSession() as session:
+                data1, truncated1 = await _fetch(session, url1, offset, self.responses)
+                data2, truncated2 = await _fetch(session, url2, offset + num_meals, self.responses)
 
-async def get_food(offset: int, num_meals: int) -> str:
-    """Get the food which will be served
+        # Render in a pool only if many days are requested
+        foodmsg_str, empty = await executor.run('menu', len(data2), _render, len(data1), data2)
+        # Do not cache an empty result because the menu may not be published yet.
+        # A menu cut off at MAX_PAYLOAD_SIZE is cached anyway, such that the large response is not fetched on every call
+        if not empty or truncated1 or truncated2:
+            self.cache.set(key, foodmsg_str)
+        return foodmsg_str
 
-    Offset defines the first meal which will be in the result
-    offset = 0 -> today
-    offset = 1 -> tomorrow
 
-    Num_meals defines the number of meals which will be in the result
+async def _fetch(
+        session: aiohttp.ClientSession, url: str, max_days: int, responses: TTLCache) -> Tuple[Dict[str, Any], bool]:
+    """Get the json data of the url. Sends a conditional request if the data is known already
 
-    Examles:
-    Food for today -> get_food(0, 1)
-    Food for the week -> get_food(0, 7)
-    Food for tomorrow and the day after -> get_food(1, 2)
+    Returns the data and whether it was cut off at MAX_PAYLOAD_SIZE.
     """
-    url1 = c.MENSA_CACHE_URL + '/' + str(offset)
-    url2 = c.MENSA_CACHE_URL + '/' + str(offset + num_meals)
+    if max_days <= 0:
+        return {}, False
+    for conditional in (True, False):
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        cached = responses.get(url) if conditional else None
+        if cached is not None:
+            etag, last_modified, cached_data, cached_size = cached
+            if etag is not None:
+                headers['If-None-Match'] = etag
+            if last_modified is not None:
+                headers['If-Modified-Since'] = last_modified
+        elif not conditional:
+            headers['Cache-Control'] = 'no-cache'
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url1) as resp:
-            data1 = await resp.json()
-        async with session.get(url2) as resp:
-            data2 = await resp.json()
+        async with session.get(url, headers=headers) as resp:
+            if resp.status != 304:
+                return await _read(resp, url, max_days, responses)
+            if cached is not None:
+                metrics.inc('mensa.http.not_modified')
+                metrics.inc('mensa.http.bytes_saved', cached_size)
+                return cached_data, False
+        # Not modified, but there is no body to reuse (e.g. the stored response expired meanwhile)
+        metrics.inc('mensa.http.not_modified_without_data')
+        logger.warning(f"{url} is not modified, but no response is stored. Fetch it again")
+    return {}, False
 
+
+async def _read(
+        resp: aiohttp.ClientResponse, url: str, max_days: int, responses: TTLCache) -> Tuple[Dict[str, Any], bool]:
+    """Decode the body while it is received and store it for conditional requests
+
+    Reading stops as soon as `max_days` days are decoded or MAX_PAYLOAD_SIZE bytes are read.
+    `mensa.http.bytes` counts the Content-Length of a complete body and the
+    (decoded) bytes read so far if reading stops early.
+    """
+    decoder = _DaysDecoder()
+    data: Dict[str, Any] = {}
+    size = 0
+    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+        size += len(chunk)
+        data.update(decoder.feed(chunk))
+        if len(data) >= max_days or decoder.done:
+            break
+        if size > MAX_PAYLOAD_SIZE:
+            metrics.inc('mensa.http.too_large')
+            metrics.inc('mensa.http.bytes', size)
+            logger.error(f"Response of {url} exceeds {MAX_PAYLOAD_SIZE} bytes. Use the first {len(data)} days")
+            return data, True
+    else:
+        decoder.close()
+    complete = decoder.done
+    transferred = int(resp.headers.get('Content-Length', size)) if complete else size
+    etag = resp.headers.get('ETag')
+    last_modified = resp.headers.get('Last-Modified')
+
+    metrics.inc('mensa.http.bytes', transferred)
+    if complete and 'Content-Encoding' in resp.headers:
+        metrics.inc('mensa.http.bytes_saved', max(size - transferred, 0))
+    data = dict(list(data.items())[:max_days])
+    if etag is not None or last_modified is not None:
+        responses.set(url, (etag, last_modified, data, size))
+    return data, False
+
+
+class _DaysDecoder:
+    """Incremental decoder of the json object of a menu
+
+    The entries (day -> meals) are returned as soon as they are complete, so
+    the rest of the body does not have to be received.
+    """
+    def __init__(self) -> None:
+        self.done = False
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._started = False
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, Any]]:
+        self._buffer += self._text.decode(chunk)
+        entries = []
+        while not self.done:
+            entry = self._next()
+            if entry is None:
+                break
+            entries.append(entry)
+        return entries
+
+    def close(self) -> None:
+        """Raise an error if the object is incomplete"""
+        if not self.done:
+            raise json.JSONDecodeError('Unexpected end of menu data', self._buffer, len(self._buffer))
+
+    def _next(self) -> Any:
+        """Decode the next entry. Returns None if more data is needed"""
+        pos = self._skip(0)
+        if not self._started:
+            if pos >= len(self._buffer):
+                return None
+            if self._buffer[pos] != '{':
+                raise json.JSONDecodeError('Expecting menu object', self._buffer, pos)
+            self._started = True
+            self._buffer = self._buffer[pos + 1:]
+            pos = self._skip(0)
+
+        if self._buffer[pos:pos + 1] == '}':
+            self.done = True
+            return None
+        try:
+            key, pos = self._json.raw_decode(self._buffer, pos)
+            pos = self._skip(pos)
+            if self._buffer[pos:pos + 1] != ':':
+                raise json.JSONDecodeError('Expecting ":"', self._buffer, pos)
+            value, pos = self._json.raw_decode(self._buffer, self._skip(pos + 1))
+        except json.JSONDecodeError:
+            # The entry is incomplete. Wait for more data
+            return None
+        pos = self._skip(pos)
+        # The separator ensures that the value is complete
+        separator = self._buffer[pos:pos + 1]
+        if separator == ',':
+            self._buffer = self._buffer[pos + 1:]
+        elif separator == '}':
+            self._buffer = self._buffer[pos:]
+        else:
+            return None
+        return key, value
+
+    def _skip(self, pos: int) -> int:
+        while pos < len(self._buffer) and self._buffer[pos] in ' \t\n\r':
+            pos += 1
+        return pos
+
+
+def _render(skip: int, data: Dict[str, Any]) -> Tuple[str, bool]:
+    """Render the meals of all days except the first `skip` days.
+    Returns the message and whether it contains no meals.
+    """
     foodmsg = ['```']
-    for i, (day, meals) in enumerate(data2.items()):
-        if i < len(data1):
+    for i, (day, meals) in enumerate(data.items()):
+        if i < skip:
             continue
         foodmsg.append(day)
         for j, meal in enumerate(meals):
@@ -36,8 +229,9 @@ async def get_food(offset: int, num_meals: int) -> str:
             for line in meal['meals']:
                 foodmsg.append(f'    {line}')
 
-    if len(foodmsg) == 1:
-        foodmsg.append('No meals received.')
+    empty = len(foodmsg) == 1
+    if empty:
+        foodmsg.append(NO_MEALS)
     foodmsg.append('```')
 
-    return '\n'.join(foodmsg)
+    return '\n'.join(foodmsg), empty
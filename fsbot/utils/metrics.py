@@ -0,0 +1,62 @@
+import asyncio
+import collections
+import logging
+from typing import DefaultDict, Dict
+
+logger = logging.getLogger(__name__)
+
+_counters: DefaultDict[str, float] = collections.defaultdict(float)
+_gauges: Dict[str, float] = {}
+_timings: Dict[str, '_Timing'] = {}
+
+
+class _Timing:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increase a counter"""
+    _counters[name] += value
+
+
+def gauge(name: str, value: float) -> None:
+    """Set a gauge to the current value"""
+    _gauges[name] = value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Record a duration"""
+    if name not in _timings:
+        _timings[name] = _Timing()
+    _timings[name].observe(seconds)
+
+
+def snapshot() -> Dict[str, float]:
+    """Current values of all metrics"""
+    result = {**_counters, **_gauges}
+    for name, timing in _timings.items():
+        result[f'{name}.count'] = timing.count
+        result[f'{name}.avg'] = timing.total / timing.count
+        result[f'{name}.max'] = timing.max
+    return result
+
+
+def reset() -> None:
+    _counters.clear()
+    _gauges.clear()
+    _timings.clear()
+
+
+async def report(interval: float) -> None:
+    """Log all metrics periodically"""
+    while True:
+        await asyncio.sleep(interval)
+        logger.info(' '.join(f'{k}={v:g}' for k, v in sorted(snapshot().items())))
@@ -0,0 +1,87 @@
+"""Compact representations of rocketbot models for data which is held in large numbers
+
+The rocketbot models are dataclasses with a `__dict__` per instance and many
+optional fields. The classes here only keep the fields fsbot needs and use
+`__slots__`, which cuts the memory per instance to a fraction.
+"""
+import sys
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import rocketbot.models as m
+import rocketbot.utils.poll as pollutil
+
+
+class UserEntry:
+    """User of the user directory"""
+    __slots__ = ('id', 'username', 'name', 'active', 'status')
+
+    def __init__(
+            self, id: str, username: str, name: Optional[str] = None,
+            active: bool = True, status: str = 'offline'):
+        self.id = id
+        self.username = username
+        self.name = name
+        self.active = active
+        self.status = status
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserEntry':
+        """Create the entry from a user object of the REST api without creating a `m.User`"""
+        return cls(
+            id=data['_id'], username=data['username'], name=data.get('name'),
+            active=data.get('active', True), status=sys.intern(data.get('status', 'offline')))
+
+    @classmethod
+    def from_user(cls, user: Union[m.User, m.UserRef]) -> 'UserEntry':
+        if isinstance(user, m.User):
+            return cls(id=user._id, username=user.username, name=user.name, active=user.active, status=user.status)
+        return cls(id=user._id, username=user.username, name=user.name)
+
+    def to_userref(self) -> m.UserRef:
+        return m.UserRef(_id=self.id, username=self.username, name=self.name)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, UserEntry):
+            return NotImplemented
+        return all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ', '.join(f'{s}={getattr(self, s)!r}' for s in self.__slots__)
+        return f'UserEntry({fields})'
+
+
+class OptionVotes:
+    """Text and voters of a poll option at one point in time
+
+    The voters are copied once into a tuple (no set, no `__dict__`), so the
+    votes stay valid while the poll changes, e.g. while an update waits to be
+    sent to kafka.
+    """
+    __slots__ = ('text', 'voters')
+
+    def __init__(self, text: str, voters: Iterable[str]):
+        self.text = text
+        self.voters = tuple(voters)
+
+    @classmethod
+    def from_option(cls, option: pollutil.PollOption, exclude: Optional[str] = None) -> 'OptionVotes':
+        """Copy the votes of the option. The user `exclude` (e.g. the bot) is left out"""
+        return cls(option.text, (u for u in option.users if u != exclude))
+
+    def to_option(self, emoji: str) -> pollutil.PollOption:
+        return pollutil.PollOption(text=self.text, emoji=emoji, users=set(self.voters))
+
+    def __len__(self) -> int:
+        return len(self.voters)
+
+    def as_tuple(self) -> Tuple[str, Tuple[str, ...]]:
+        """(text, voters) as expected by the kafka producer"""
+        return self.text, self.voters
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, OptionVotes):
+            return NotImplemented
+        return self.text == other.text and set(self.voters) == set(other.voters)
+
+    def __repr__(self) -> str:
+        return f'OptionVotes(text={self.text!r}, voters={sorted(self.voters)!r})'
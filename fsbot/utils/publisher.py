@@ -0,0 +1,193 @@
+"""Publishing of poll updates to kafka without blocking the event loop
+
+Updates are put into a bounded queue and sent by a background task. The
+producer runs in a thread because connecting and sending may block until the
+broker times out. While the broker is unreachable the updates are written to
+a spool which is replayed in order as soon as the broker is back.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+import fsbot.utils.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+# Options of a poll as sent to kafka: (text, voters)
+Update = Sequence[Tuple[str, Sequence[str]]]
+
+
+class Spool:
+    """Updates which could not be sent yet, in the order they were published
+
+    The updates are kept in memory. If `path` is given, they are also kept in
+    a file (one json line per update) such that they survive a restart. The
+    file is only read on creation.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._updates: List[Update] = _load(path) if path is not None else []
+
+    def __len__(self) -> int:
+        return len(self._updates)
+
+    def append(self, updates: Iterable[Update]) -> None:
+        updates = list(updates)
+        if not updates:
+            return
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.writelines(json.dumps(u) + '\n' for u in updates)
+        self._updates.extend(updates)
+        metrics.inc('kafka.spool.writes', len(updates))
+        metrics.gauge('kafka.spool', len(self._updates))
+
+    def read(self) -> List[Update]:
+        return list(self._updates)
+
+    def replace(self, updates: List[Update]) -> None:
+        """Replace the content by the given (remaining) updates"""
+        if self.path is not None and updates:
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(u) + '\n' for u in updates)
+            os.replace(tmp_path, self.path)
+        elif self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self._updates = list(updates)
+        metrics.gauge('kafka.spool', len(self._updates))
+
+
+def _load(path: str) -> List[Update]:
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+class KafkaPublisher:
+    """Send poll updates to kafka in the background
+
+    `producer_factory` creates a producer with `sendV1`, `flush` and `close`
+    (e.g. `RocketchatMensaProducer`). The producer is created once and reused
+    until sending fails.
+    """
+    def __init__(
+            self, producer_factory: Callable[[], Any], spool: Optional[Spool] = None,
+            maxsize: int = 100, retry_interval: float = 30):
+        self.producer_factory = producer_factory
+        self.spool = spool if spool is not None else Spool()
+        self.retry_interval = retry_interval
+        self._queue: 'asyncio.Queue[Update]' = asyncio.Queue(maxsize)
+        self._producer: Optional[Any] = None
+        self._task: Optional['asyncio.Task[None]'] = None
+        # Update which is taken from the queue but not sent yet
+        self._current: Optional[Update] = None
+
+    def start(self) -> None:
+        """Start the background task which also replays the spool of the last run"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def publish(self, update: Update) -> None:
+        """Queue an update. Never blocks: If the queue is full, the queue is moved to the spool
+
+        The update is kept as it is, so it must not be changed afterwards.
+        """
+        self.start()
+        metrics.inc('kafka.published')
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            metrics.inc('kafka.queue.full')
+            # Keep the order: Everything queued so far precedes the new update
+            self.spool.append([*self._drain_queue(), update])
+        metrics.gauge('kafka.queue', self._queue.qsize())
+
+    async def flush(self) -> None:
+        """Send the queued updates and stop the background task
+
+        Updates which are not sent when this is canceled (e.g. by the drain
+        deadline) or while the broker is unreachable are written to the spool.
+        """
+        try:
+            while (not self._queue.empty() or self._current is not None) and len(self.spool) == 0:
+                if self._task is None or self._task.done():
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            if self._task is not None:
+                self._task.cancel()
+            # An update which is canceled while sending is spooled, so it is sent at least once
+            current, self._current = self._current, None
+            self.spool.append([*([current] if current is not None else []), *self._drain_queue()])
+            await self._reset()
+
+    async def _run(self) -> None:
+        while True:
+            if len(self.spool) > 0 and not await self._replay():
+                await asyncio.sleep(self.retry_interval)
+                continue
+            update = self._current = await self._queue.get()
+            metrics.gauge('kafka.queue', self._queue.qsize())
+            if len(self.spool) > 0:
+                # Keep the order: The update has to wait for the older updates in the spool
+                self.spool.append([update])
+            elif not await self._send(update):
+                # Updates which were spooled while sending are newer
+                self.spool.replace([update, *self.spool.read()])
+            self._current = None
+
+    async def _replay(self) -> bool:
+        """Send the spooled updates in order. Returns True if the spool is empty afterwards"""
+        while len(self.spool) > 0:
+            updates = self.spool.read()
+            for i, update in enumerate(updates):
+                if not await self._send(update):
+                    # Keep the updates which were spooled during the replay
+                    self.spool.replace(updates[i:] + self.spool.read()[len(updates):])
+                    return False
+                metrics.inc('kafka.replayed')
+            self.spool.replace(self.spool.read()[len(updates):])
+            logger.info(f"Replayed {len(updates)} spooled kafka messages")
+        return True
+
+    async def _send(self, update: Update) -> bool:
+        start = time.monotonic()
+        try:
+            if self._producer is None:
+                self._producer = await self._call(self.producer_factory)
+            await self._call(self._producer.sendV1, update)
+            await self._call(self._producer.flush)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.inc('kafka.failed')
+            logger.warning(f"Could not send kafka message: {type(e).__name__}: {e}")
+            await self._reset()
+            return False
+        metrics.inc('kafka.sent')
+        metrics.observe('kafka.send.seconds', time.monotonic() - start)
+        return True
+
+    async def _reset(self) -> None:
+        producer, self._producer = self._producer, None
+        if producer is not None:
+            try:
+                await self._call(producer.close)
+            except Exception:
+                pass
+
+    async def _call(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _drain_queue(self) -> List[Update]:
+        updates = []
+        while not self._queue.empty():
+            updates.append(self._queue.get_nowait())
+        metrics.gauge('kafka.queue', 0)
+        return updates
@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import dataclasses
+import enum
+import functools
+import heapq
+import itertools
+import logging
+from typing import (
+    Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+)
+
+import rocketbot.master as master
+import rocketbot.models as m
+
+import fsbot.utils.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Rocket.Chat rejects messages exceeding 5000 characters by default
+MAX_MESSAGE_LENGTH = 4000
+
+# Outbound calls of the ddp client which count against the rate limit
+LIMITED_CALLS = ['send_message', 'update_message', 'delete_message', 'set_reaction']
+
+
+class Priority(enum.IntEnum):
+    """Priority of an outbound job. Jobs with a lower value are sent first."""
+    REPLY = 0
+    UPDATE = 1
+
+
+class TokenBucket:
+    """Token bucket rate limiter
+
+    Allows bursts of up to `capacity` operations and `rate` operations per second on average.
+    Callers which have to wait for a token get it in order of their priority (lower value first).
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last: Optional[float] = None
+        self._waiters: List[Tuple[int, int, 'asyncio.Future[None]']] = []
+        self._counter = itertools.count()
+        self._dispatcher: Optional['asyncio.Task[None]'] = None
+
+    def _refill(self, now: float) -> None:
+        if self._last is not None:
+            self._tokens = min(float(self.capacity), self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Wait until a token is available and take it"""
+        loop = asyncio.get_event_loop()
+        self._refill(loop.time())
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._dispatcher is None:
+            self._dispatcher = loop.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while self._waiters:
+                self._refill(loop.time())
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                # A canceled caller does not take a token
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
+        finally:
+            self._dispatcher = None
+
+
+# Priority of the job which is processed by the current task. Calls outside of the
+# queue (e.g. poll updates triggered by reactions) are treated like updates
+_priority: 'contextvars.ContextVar[Priority]' = contextvars.ContextVar('send_priority', default=Priority.UPDATE)
+
+
+@dataclasses.dataclass
+class _Job:
+    roomid: str
+    priority: Priority
+    future: 'asyncio.Future[Any]'
+    msg: Optional[str] = None
+    action: Optional[Callable[[], Awaitable[Any]]] = None
+    # Span of the message which caused the job
+    span: Optional[tracing.Span] = dataclasses.field(default_factory=tracing.current_span)
+
+
+class SendQueue:
+    """Shared outbound queue for all messages sent by the bot
+
+    - All messages are rate limited by a token bucket. If `limit_ddp` is
+      called, each call of an action (e.g. the messages and reactions of a
+      poll refresh) takes a token as well
+    - Jobs with a higher priority (e.g. direct replies) get tokens before jobs
+      with a lower priority (e.g. poll refreshes)
+    - Jobs of the same room are processed one after another, ordered by
+      priority and in order within a priority. Jobs of different rooms are
+      processed concurrently, so a slow action only delays its own room
+    - Consecutive messages to the same room which are still waiting are merged
+      into a single message
+    """
+    def __init__(self, master: master.Master, rate: float = 5.0, burst: int = 10):
+        self.master = master
+        self._bucket = TokenBucket(rate, burst)
+        self._counter = itertools.count()
+        # Waiting jobs and the worker task by roomid
+        self._queues: Dict[str, List[Tuple[int, int, _Job]]] = {}
+        self._workers: Dict[str, 'asyncio.Task[None]'] = {}
+        self._last_job_by_roomid: Dict[str, _Job] = {}
+        # Calls of the ddp client before `limit_ddp` wrapped them
+        self._unlimited: Dict[str, Callable[..., Awaitable[Any]]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def limit_ddp(self) -> None:
+        """Take a token for each outbound call of the ddp client of the master
+
+        This includes the calls of actions and of the poll manager outside of
+        the queue. Has to be called once per master.
+        """
+        ddp = self.master.ddp
+        for name in LIMITED_CALLS:
+            call = getattr(ddp, name)
+            self._unlimited[name] = call
+            setattr(ddp, name, self._limited(call))
+
+    def _limited(self, call: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(call)
+        async def _call(*args: Any, **kwargs: Any) -> T:
+            await self._bucket.acquire(_priority.get())
+            return await call(*args, **kwargs)
+        return _call
+
+    async def send_message(self, roomid: str, msg: str, priority: Priority = Priority.REPLY) -> m.Message:
+        """Send a message to a room as soon as the rate limit allows it
+
+        If the message was merged with other messages the result is the merged message
+        """
+        last_job = self._last_job_by_roomid.get(roomid)
+        if (last_job is not None
+                and last_job.msg is not None
+                and last_job.priority == priority
+                and len(last_job.msg) + len(msg) < MAX_MESSAGE_LENGTH):
+            last_job.msg += '\n' + msg
+            logger.debug(f"Merged message for room {roomid}")
+            return await last_job.future
+
+        return await self._enqueue(_Job(roomid=roomid, priority=priority, future=self._create_future(), msg=msg))
+
+    async def submit(
+            self, roomid: str,
+            action: Callable[[], Awaitable[T]],
+            priority: Priority = Priority.UPDATE) -> T:
+        """Run an arbitrary action which sends or updates messages (e.g. a poll refresh)
+        in order with the other jobs of the room
+        """
+        result: T = await self._enqueue(
+            _Job(roomid=roomid, priority=priority, future=self._create_future(), action=action))
+        return result
+
+    async def flush(self) -> None:
+        """Wait until all queued jobs are processed"""
+        while self._workers:
+            await asyncio.wait(list(self._workers.values()))
+
+    def _create_future(self) -> 'asyncio.Future[Any]':
+        return asyncio.get_event_loop().create_future()
+
+    async def _enqueue(self, job: _Job) -> Any:
+        queue = self._queues.setdefault(job.roomid, [])
+        heapq.heappush(queue, (job.priority, next(self._counter), job))
+        self._last_job_by_roomid[job.roomid] = job
+        if job.roomid not in self._workers:
+            self._workers[job.roomid] = asyncio.get_event_loop().create_task(self._work(job.roomid))
+        return await job.future
+
+    async def _work(self, roomid: str) -> None:
+        # The worker serves all messages of the room and must not be part of the trace which started it
+        tracing.detach()
+        queue = self._queues[roomid]
+        try:
+            while queue:
+                _, _, job = heapq.heappop(queue)
+                # A job which is already processed must not be extended anymore
+                if self._last_job_by_roomid.get(roomid) is job:
+                    del self._last_job_by_roomid[roomid]
+
+                _priority.set(job.priority)
+                with tracing.span('send', parent=job.span, room_id=roomid):
+                    try:
+                        if job.msg is not None:
+                            await self._bucket.acquire(job.priority)
+                            send = self._unlimited.get('send_message', self.master.ddp.send_message)
+                            result = await send(roomid, job.msg)
+                        elif job.action is not None:
+                            result = await job.action()
+                        if not job.future.done():
+                            job.future.set_result(result)
+                    except Exception as e:
+                        if not job.future.done():
+                            job.future.set_exception(e)
+        finally:
+            del self._workers[roomid]
+            if not queue:
+                del self._queues[roomid]
@@ -0,0 +1,115 @@
+import logging
+import multiprocessing
+import signal
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import rocketbot.bots as bots
+import rocketbot.master as master
+import rocketbot.models as m
+import rocketbot.utils.poll as pollutil
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before a crashed worker is restarted
+RESTART_DELAY = 5
+
+
+class Shard:
+    """Partition of the rooms handled by one of `count` worker processes"""
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+
+    def owns(self, roomid: str) -> bool:
+        return zlib.crc32(roomid.encode()) % self.count == self.index
+
+    def apply(self, masterbot: master.Master, pollmanager: pollutil.PollManager) -> None:
+        """Restrict the bots of the master to the rooms of this shard
+
+        - Command bots handle only messages of own rooms
+        - The poll bot is not restricted because it handles only polls which
+          are known to this worker. This way a poll can still be pushed to any room.
+        - The status bot handles only status messages of own polls
+        """
+        for bot in masterbot.bots:
+            if bot is pollmanager.roomBot:
+                continue
+            if isinstance(bot, bots.RoomCustomBot):
+                setattr(bot, 'handle', self._own_polls_only(pollmanager, bot.handle))
+            else:
+                setattr(bot, 'handle', self._own_rooms_only(bot.handle))
+
+        # Forget the polls of other shards which were loaded from the status room
+        polls = pollutil.PollCache()
+        for poll in pollmanager.polls.by_id.values():
+            if self.owns(poll.roomid):
+                polls.add(poll)
+        pollmanager.polls = polls
+
+    def _own_rooms_only(
+            self, handle: Callable[[m.Message], Awaitable[None]]) -> Callable[[m.Message], Awaitable[None]]:
+        async def _handle(message: m.Message) -> None:
+            if self.owns(message.roomid):
+                await handle(message)
+        return _handle
+
+    def _own_polls_only(
+            self, pollmanager: pollutil.PollManager,
+            handle: Callable[[m.Message], Awaitable[None]]) -> Callable[[m.Message], Awaitable[None]]:
+        async def _handle(message: m.Message) -> None:
+            if pollmanager.polls.get(status_msg_id=message.id) is not None:
+                await handle(message)
+        return _handle
+
+
+def supervise(count: int, worker: Callable[[Shard, Dict[str, Any]], None], stores: List[str],
+              init: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+    """Run `count` worker processes and restart them if they crash
+
+    Each worker is called with its shard and the stores (dicts shared between
+    all workers via a manager process) which can be used for shared caches.
+    `init` is called once with the stores before the first worker starts, so
+    a restarted worker continues with the stores the other workers left behind.
+    """
+    stopping = False
+
+    def _stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        logger.info(f"{signal.Signals(signum).name} received. Stopping workers")
+        stopping = True
+
+    with multiprocessing.Manager() as manager:
+        shared = {name: manager.dict() for name in stores}
+        if init is not None:
+            init(shared)
+        processes: Dict[int, multiprocessing.Process] = {}
+        # Point in time (monotonic) at which a crashed worker is restarted by index
+        restart_at: Dict[int, float] = {}
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        while not stopping:
+            now = time.monotonic()
+            for index in range(count):
+                process = processes.get(index)
+                if process is not None and process.is_alive():
+                    continue
+                if process is not None and index not in restart_at:
+                    logger.error(f"Worker {index} exited with code {process.exitcode}. Restart in {RESTART_DELAY}s")
+                    restart_at[index] = now + RESTART_DELAY
+                # The other workers are still supervised while a crashed one waits for its restart
+                if restart_at.get(index, now) > now:
+                    continue
+                restart_at.pop(index, None)
+                process = multiprocessing.Process(
+                    target=worker, args=(Shard(index, count), shared), name=f'worker-{index}')
+                process.start()
+                processes[index] = process
+            time.sleep(1)
+
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
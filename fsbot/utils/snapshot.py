@@ -0,0 +1,91 @@
+import asyncio
+import functools
+import logging
+import os
+import pickle
+import struct
+import time
+import zlib
+from typing import Dict
+
+from fsbot.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Increase if the format or the content of the caches changes
+VERSION = 2
+
+# File layout: header (magic, version, creation time) followed by the zlib compressed pickle of the cache entries
+_MAGIC = b'FSBOTSNP'
+_HEADER = struct.Struct('>8sHd')
+
+
+def save(path: str, caches: Dict[str, TTLCache]) -> None:
+    """Write the entries of the caches to a file"""
+    write(path, dump(caches))
+
+
+def dump(caches: Dict[str, TTLCache]) -> bytes:
+    """Pickle the entries of the caches
+
+    Has to run in the thread which modifies the caches (the event loop), the
+    result can be written by `write` in any thread.
+    """
+    data = {name: dict(cache.store.items()) for name, cache in caches.items()}
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def write(path: str, pickled: bytes) -> None:
+    """Compress the pickled entries and write them to a file
+
+    The file is replaced atomically such that a starting instance never reads a partial snapshot
+    """
+    payload = zlib.compress(pickled)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, VERSION, time.time()))
+        f.write(payload)
+    os.replace(tmp_path, path)
+    logger.info(f"Cache snapshot written to {path} ({_HEADER.size + len(payload)} bytes)")
+
+
+def load(path: str, caches: Dict[str, TTLCache], max_age: float) -> bool:
+    """Fill the caches from a snapshot file
+
+    Snapshots of another version or older than `max_age` seconds are ignored.
+    Expired entries are dropped by the caches themselves.
+    """
+    try:
+        with open(path, 'rb') as f:
+            magic, version, created = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC or version != VERSION:
+                logger.warning(f"Ignore cache snapshot {path} of unknown format")
+                return False
+            if created < time.time() - max_age:
+                logger.info(f"Ignore outdated cache snapshot {path}")
+                return False
+            data = pickle.loads(zlib.decompress(f.read()))
+    except FileNotFoundError:
+        return False
+    except Exception as e:
+        logger.warning(f"Could not load cache snapshot {path}: {type(e).__name__}: {e}")
+        return False
+
+    for name, cache in caches.items():
+        cache.store.update(data.get(name, {}))
+    logger.info(f"Cache snapshot loaded from {path}")
+    return True
+
+
+async def save_periodically(path: str, caches: Dict[str, TTLCache], interval: float) -> None:
+    """Write a snapshot every `interval` seconds such that even a crash leaves warm caches behind"""
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The caches are modified on the loop, so they are pickled here. Compressing and writing run in a thread
+            await loop.run_in_executor(None, functools.partial(write, path, dump(caches)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Could not write cache snapshot: {type(e).__name__}: {e}", exc_info=True)
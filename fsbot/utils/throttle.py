@@ -0,0 +1,74 @@
+import asyncio
+import collections
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+
+class Throttle:
+    """Per user throttle of a command
+
+    - Sliding window: A user may run the command at most `limit` times within `window` seconds
+    - In-flight deduplication: An identical request which arrives while the first
+      one is still running waits for the first one instead of running again. It
+      does not count towards the limit.
+    """
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._requests_by_user: Dict[str, Deque[float]] = {}
+        self._next_prune = 0.0
+        self._in_flight: Dict[Hashable, asyncio.Event] = {}
+
+    async def run(
+            self, user: str, key: Hashable,
+            func: Callable[[], Awaitable[None]],
+            deduplicate: bool = True) -> Optional[float]:
+        """Run `func` unless the user exceeds the limit
+
+        Requests with the same key are deduplicated while in flight. Returns None
+        if the request was handled, otherwise the seconds until the user may retry.
+        """
+        if deduplicate and key in self._in_flight:
+            await self._in_flight[key].wait()
+            return None
+
+        retry_in = self._acquire(user, asyncio.get_event_loop().time())
+        if retry_in is not None:
+            return retry_in
+
+        if not deduplicate:
+            await func()
+            return None
+
+        done = asyncio.Event()
+        self._in_flight[key] = done
+        try:
+            await func()
+        finally:
+            del self._in_flight[key]
+            done.set()
+        return None
+
+    def _acquire(self, user: str, now: float) -> Optional[float]:
+        """Record a request of the user if the limit allows it.
+        Otherwise return the seconds until the oldest request leaves the window.
+        """
+        if now >= self._next_prune:
+            self._prune(now)
+        requests = self._requests_by_user.get(user)
+        if requests is None:
+            requests = self._requests_by_user[user] = collections.deque()
+        while requests and requests[0] <= now - self.window:
+            requests.popleft()
+        if len(requests) >= self.limit:
+            return requests[0] + self.window - now
+        requests.append(now)
+        return None
+
+    def _prune(self, now: float) -> None:
+        """Forget the users without requests in the window. Runs at most once per window"""
+        expired = [
+            user for user, requests in self._requests_by_user.items()
+            if not requests or requests[-1] <= now - self.window]
+        for user in expired:
+            del self._requests_by_user[user]
+        self._next_prune = now + self.window
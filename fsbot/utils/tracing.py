@@ -0,0 +1,288 @@
+"""Lightweight tracing of the path of a message through the bot
+
+Each incoming message starts a trace whose id is used as correlation id. The
+current span is tracked in a context variable and follows the message across awaits.
+"""
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import time
+from typing import (
+    Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, TypeVar
+)
+
+import aiohttp
+import rocketbot.bots.base as b
+import rocketbot.commands as c
+import rocketbot.master as master
+import rocketbot.models as m
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.end: Optional[float] = None
+        # Finished spans of the trace are collected by the root span and exported together
+        self._root: Span = parent._root if parent is not None else self
+        self._finished: List[Span] = []
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self) -> None:
+        self.end = time.time()
+        if self._root is not self and self._root.end is None:
+            self._root._finished.append(self)
+        elif _tracer is not None:
+            _tracer.exporter.export([*self._finished, self])
+            self._finished = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'attributes': self.attributes,
+        }
+
+
+class Exporter:
+    """Base exporter which drops all spans"""
+    def export(self, spans: List[Span]) -> None:
+        pass
+
+    async def close(self) -> None:
+        """Export the pending spans and release the resources of the exporter"""
+        pass
+
+
+class JsonlExporter(Exporter):
+    """Append each span as json line to a local file"""
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            with open(self.path, 'a') as f:
+                f.writelines(json.dumps(s.to_dict(), default=str) + '\n' for s in spans)
+        except OSError as e:
+            logger.warning(f"Could not export spans: {e}")
+
+
+class OtlpExporter(Exporter):
+    """Send spans to an OTLP/HTTP collector (json encoding) in the background
+
+    All requests share one session which is closed by `close`.
+    """
+    def __init__(self, url: str, service_name: str = 'fsbot'):
+        self.url = url
+        self.service_name = service_name
+        self._session: Optional[aiohttp.ClientSession] = None
+        # The loop keeps weak references to tasks only
+        self._tasks: Set['asyncio.Task[None]'] = set()
+
+    def export(self, spans: List[Span]) -> None:
+        task = asyncio.get_event_loop().create_task(self._post(self.to_otlp(spans)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def to_otlp(self, spans: List[Span]) -> Dict[str, Any]:
+        return {
+            'resourceSpans': [{
+                'resource': {
+                    'attributes': [{'key': 'service.name', 'value': {'stringValue': self.service_name}}],
+                },
+                'scopeSpans': [{
+                    'scope': {'name': __name__},
+                    'spans': [self._span_to_otlp(s) for s in spans],
+                }],
+            }],
+        }
+
+    def _span_to_otlp(self, span: Span) -> Dict[str, Any]:
+        return {
+            # Otlp expects a 128 bit trace id
+            'traceId': span.trace_id.rjust(32, '0'),
+            'spanId': span.span_id,
+            'parentSpanId': span.parent_id or '',
+            'name': span.name,
+            'startTimeUnixNano': str(int(span.start * 1e9)),
+            'endTimeUnixNano': str(int((span.end or span.start) * 1e9)),
+            'attributes': [{'key': k, 'value': {'stringValue': str(v)}} for k, v in span.attributes.items()],
+        }
+
+    async def _post(self, data: Dict[str, Any]) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        try:
+            async with self._session.post(self.url, json=data) as resp:
+                if resp.status >= 300:
+                    logger.warning(f"Could not export spans: Status {resp.status}")
+        except aiohttp.ClientError as e:
+            logger.warning(f"Could not export spans: {e}")
+
+
+def create_exporter(target: str) -> Exporter:
+    """Create an OTLP exporter for http(s) urls and a JSONL exporter otherwise"""
+    if target.startswith('http://') or target.startswith('https://'):
+        return OtlpExporter(target)
+    return JsonlExporter(target)
+
+
+class _Tracer:
+    def __init__(self, exporter: Exporter, sample_rate: float):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+
+_tracer: Optional[_Tracer] = None
+
+# Marks a message which is not sampled, so child spans are skipped
+_NOT_SAMPLED = Span('not sampled', '', None, {})
+
+_current_span: 'contextvars.ContextVar[Optional[Span]]' = contextvars.ContextVar('current_span', default=None)
+
+
+def init(exporter: Exporter, sample_rate: float = 1.0) -> None:
+    """Enable tracing. Only the given share of messages is traced, for all
+    other messages a span costs a context variable lookup only.
+    """
+    global _tracer
+    _tracer = _Tracer(exporter, sample_rate)
+
+
+async def close() -> None:
+    """Export the pending spans on shutdown"""
+    if _tracer is not None:
+        await _tracer.exporter.close()
+
+
+def current_span() -> Optional[Span]:
+    """Return the current span or None if the current message is not traced"""
+    span = _current_span.get()
+    return span if span is not _NOT_SAMPLED else None
+
+
+def detach() -> None:
+    """Detach the current task from the trace it was created in"""
+    _current_span.set(None)
+
+
+@contextlib.contextmanager
+def _activate(span: Span) -> Iterator[Optional[Span]]:
+    token = _current_span.set(span)
+    try:
+        yield span if span is not _NOT_SAMPLED else None
+    except BaseException as e:
+        span.set_attribute('error', f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        _current_span.reset(token)
+        if span is not _NOT_SAMPLED:
+            span.finish()
+
+
+@contextlib.contextmanager
+def trace(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Start a new trace. Yields the root span or None if the trace is not sampled"""
+    if _tracer is None:
+        yield None
+        return
+    if random.random() >= _tracer.sample_rate:
+        span = _NOT_SAMPLED
+    else:
+        span = Span(name, os.urandom(8).hex(), None, attributes)
+    with _activate(span) as s:
+        yield s
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Start a span as child of the given or the current span
+
+    Yields None without recording anything if there is no (sampled) trace
+    """
+    if parent is None:
+        parent = _current_span.get()
+    if parent is None or parent is _NOT_SAMPLED:
+        yield None
+        return
+    with _activate(Span(name, parent.trace_id, parent, attributes)) as s:
+        yield s
+
+
+def _traced(name: str, func: Callable[..., Awaitable[T]], **attributes: Any) -> Callable[..., Awaitable[T]]:
+    @functools.wraps(func)
+    async def _wrapper(*args: Any, **kwargs: Any) -> T:
+        with span(name, **attributes):
+            return await func(*args, **kwargs)
+    return _wrapper
+
+
+def instrument_master(masterbot: master.Master) -> None:
+    """Start a trace for each incoming message
+
+    The root span records the receive latency, i.e. the time between the
+    creation of the message on the server and its arrival via ddp (includes
+    the clock difference of both hosts).
+    Has to be called before the bots are enabled
+    """
+    subscribe = masterbot.ddp.subscribe_my_messages
+
+    async def _subscribe_my_messages(callback: Callable[[m.SubscriptionResult], Awaitable[Any]]) -> Any:
+        async def _callback(result: m.SubscriptionResult) -> None:
+            message = result.message
+            with trace('message', message_id=message.id, room_id=message.roomid) as root:
+                if root is not None and message.created_at is not None:
+                    latency = root.start - message.created_at.value.timestamp()
+                    root.set_attribute('receive_latency_ms', round(latency * 1000))
+                await callback(result)
+        return await subscribe(_callback)
+
+    setattr(masterbot.ddp, 'subscribe_my_messages', _subscribe_my_messages)
+
+
+def instrument_bot(bot: b.BaseBot) -> None:
+    """Create a span for message filtering and handling of the bot"""
+    setattr(bot, 'handle', _traced('bot', bot.handle, bot=type(bot).__name__))
+
+
+def instrument_command(command: c.BaseCommand) -> None:
+    """Create spans for the command matching and handling"""
+    name = type(command).__name__
+    can_handle = command.can_handle
+
+    @functools.wraps(can_handle)
+    def _can_handle(cmd: str) -> bool:
+        with span('can_handle', command=name) as s:
+            result = can_handle(cmd)
+            if s is not None:
+                s.set_attribute('result', result)
+            return result
+
+    setattr(command, 'can_handle', _can_handle)
+    setattr(command, 'handle', _traced('command', command.handle, command=name))
@@ -0,0 +1,177 @@
+"""Directory of all users which is kept up to date by realtime events
+
+The directory is seeded once per connection and then updated incrementally
+from the `stream-notify-logged` stream of the ddp connection, so commands can
+look up users without downloading the whole user list.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import rocketbot.master as master
+
+import fsbot.utils.metrics as metrics
+from fsbot.utils.cache import TTLCache
+from fsbot.utils.models import UserEntry
+
+logger = logging.getLogger(__name__)
+
+_STREAM = 'stream-notify-logged'
+_EVENTS = ['user-status', 'Users:NameChanged', 'Users:Deleted']
+
+# Status codes of the user-status event
+STATUS = ['offline', 'online', 'away', 'busy']
+
+# Seconds to collect changes before the cached seed is rewritten
+STORE_DELAY = 10.0
+
+
+class UserDirectory:
+    """Index of the users by username and by id
+
+    `cache` keeps the seed such that a restart does not have to download all
+    users again (see the cache snapshot). Changes are written to the cache at
+    most once per `STORE_DELAY` seconds because each write copies the whole
+    list (and sends it to the manager process in supervisor mode).
+    """
+    def __init__(self, master: master.Master, cache: Optional[TTLCache] = None):
+        self.master = master
+        self.cache = cache if cache is not None else TTLCache(ttl=600)
+        self._by_username: Dict[str, UserEntry] = {}
+        self._by_id: Dict[str, UserEntry] = {}
+        self._task: Optional['asyncio.Task[None]'] = None
+        self._store_handle: Optional[asyncio.TimerHandle] = None
+        # Events received while seeding, they are applied to the new index afterwards
+        self._pending: Optional[List[Tuple[str, List[Any]]]] = None
+
+    def __len__(self) -> int:
+        return len(self._by_username)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._by_username
+
+    def get(self, username: str) -> Optional[UserEntry]:
+        return self._by_username.get(username)
+
+    def get_by_id(self, user_id: str) -> Optional[UserEntry]:
+        return self._by_id.get(user_id)
+
+    def usernames(self, active_only: bool = True) -> List[str]:
+        return [u.username for u in self._by_username.values() if u.active or not active_only]
+
+    def attach(self) -> None:
+        """(Re)start the directory whenever the master connects
+
+        Has to be called before the master is started
+        """
+        enable_bots = self.master.enable_bots
+
+        async def _enable_bots() -> None:
+            await enable_bots()
+            await self.start()
+
+        setattr(self.master, 'enable_bots', _enable_bots)
+
+    async def start(self) -> None:
+        """Subscribe to the user events and seed the directory
+
+        Subscribing first and replaying the events received while seeding ensures that no change is lost.
+        """
+        col = self.master.ddp.client.get_collection(_STREAM)
+        # Stream collections contain a single document with the id 'id' which receives all events
+        col._data.setdefault('id', {})
+        queue = col.get_queue()
+        self._task = asyncio.create_task(self._consume(queue))
+        # The task is canceled by the ddp client on disconnect
+        self.master.ddp.subscription_tasks.append(self._task)
+        for event in _EVENTS:
+            await self.master.ddp.client.subscribe(_STREAM, event, False)
+        await self.seed()
+
+    async def seed(self) -> None:
+        self._pending = []
+        try:
+            # Changes of the last connection are part of the seed
+            await self.flush()
+            users = self.cache.get('users')
+            if users is None:
+                result = await self.master.rest.users_list(count=0)
+                users = [UserEntry.from_dict(u) for u in result.json()['users'] if 'username' in u]
+                self.cache.set('users', users)
+            self._by_username = {u.username: u for u in users}
+            self._by_id = {u.id: u for u in users}
+            metrics.gauge('users.directory', len(self._by_username))
+            logger.info(f"User directory seeded with {len(users)} users")
+            # The seed may not contain these changes yet
+            for event_name, args in self._pending:
+                self._apply_logged(event_name, args)
+        finally:
+            self._pending = None
+
+    async def _consume(self, queue: 'asyncio.Queue[Any]') -> None:
+        while True:
+            event = await queue.get()
+            if event['type'] != 'changed':
+                continue
+            event_name, args = event['fields']['eventName'], event['fields']['args']
+            if self._pending is not None:
+                self._pending.append((event_name, args))
+            else:
+                self._apply_logged(event_name, args)
+
+    def _apply_logged(self, event_name: str, args: List[Any]) -> None:
+        try:
+            self.apply(event_name, args)
+        except Exception:
+            logger.exception(f"Could not apply user event {event_name}: {args}")
+
+    def apply(self, event_name: str, args: List[Any]) -> None:
+        """Apply a single event of the stream to the directory"""
+        metrics.inc(f'users.events.{event_name}')
+        if event_name == 'user-status':
+            user_id, username, status = args[0][:3]
+            user = self._by_id.get(user_id)
+            if user is None:
+                # A user which was created after seeding
+                self._add(UserEntry(id=user_id, username=username))
+                user = self._by_id[user_id]
+            user.status = STATUS[status] if 0 <= status < len(STATUS) else 'offline'
+        elif event_name == 'Users:NameChanged':
+            data = args[0]
+            user = self._by_id.get(data['_id'])
+            if user is None:
+                self._add(UserEntry(id=data['_id'], username=data['username'], name=data.get('name')))
+                return
+            if data.get('username') is not None and data['username'] != user.username:
+                del self._by_username[user.username]
+                user.username = data['username']
+                self._by_username[user.username] = user
+            if data.get('name') is not None:
+                user.name = data['name']
+            self._store()
+        elif event_name == 'Users:Deleted':
+            user = self._by_id.pop(args[0]['userId'], None)
+            if user is not None:
+                del self._by_username[user.username]
+                self._store()
+
+    def _add(self, user: UserEntry) -> None:
+        self._by_id[user.id] = user
+        self._by_username[user.username] = user
+        self._store()
+
+    def _store(self) -> None:
+        """Schedule writing the changes to the cached seed"""
+        metrics.gauge('users.directory', len(self._by_username))
+        if self._store_handle is None:
+            self._store_handle = asyncio.get_event_loop().call_later(STORE_DELAY, self._write)
+
+    def _write(self) -> None:
+        self._store_handle = None
+        self.cache.set('users', list(self._by_id.values()))
+
+    async def flush(self) -> None:
+        """Write pending changes to the cached seed now (e.g. before a snapshot)"""
+        if self._store_handle is not None:
+            self._store_handle.cancel()
+            self._write()
@@ -1,8 +1,12 @@
 import asyncio
+import concurrent.futures
+import datetime
+import functools
 import logging
 import time
 import requests
 from json import JSONDecodeError
+from typing import Any, Dict, Optional
 
 # Configure logging before importing because some submodule tries to configures the logger
 console = logging.StreamHandler()
@@ -14,7 +18,9 @@ root.addHandler(console)
 # Configure logglevels
 logging.getLogger().setLevel(logging.WARNING)
 logging.getLogger("rocketbot").setLevel(logging.INFO)
+logging.getLogger("fsbot").setLevel(logging.INFO)
 
+from ftfbroker.producer.rocketchat_mensa import RocketchatMensaProducer  # noqa: E402
 from rocketchat_API.APIExceptions.RocketExceptions import RocketConnectionException  # noqa: E402
 
 import rocketbot.bots as bots  # noqa: E402
@@ -25,14 +31,40 @@ import rocketbot.utils.poll as pollutil  # noqa: E402
 import rocketbot.utils.sentry as sentry  # noqa: E402
 
 import fsbot.commands as com2  # noqa: E402
+import fsbot.utils.broadcast as broadcast  # noqa: E402
+import fsbot.utils.drain as drain  # noqa: E402
+import fsbot.utils.executor as ex  # noqa: E402
+import fsbot.utils.meals as meals  # noqa: E402
+import fsbot.utils.metrics as metrics  # noqa: E402
+import fsbot.utils.publisher as pub  # noqa: E402
+import fsbot.utils.sendqueue as sq  # noqa: E402
+import fsbot.utils.sharding as sharding  # noqa: E402
+import fsbot.utils.snapshot as snapshot  # noqa: E402
+import fsbot.utils.throttle as th  # noqa: E402
+import fsbot.utils.tracing as tracing  # noqa: E402
+from fsbot.utils.cache import TTLCache  # noqa: E402
+from fsbot.utils.users import UserDirectory  # noqa: E402
 
 try:
     import bot_config as c
 except ModuleNotFoundError:
     raise Exception('Please provide the login credentials in a bot_config.py') from None
 
+# Seed of the user directory. Shared between the workers in supervisor mode
+users_cache = TTLCache(ttl=600)
+# Room info by room name (e.g. of the status room) to speed up the start
+rooms_cache = TTLCache(ttl=86400)
 
-async def setup_bot() -> master.Master:
+# Caches which are written to the snapshot file and loaded on start
+caches = {
+    'menu': meals.cache,
+    'mensa_responses': meals.responses,
+    'users': users_cache,
+    'rooms': rooms_cache,
+}
+
+
+async def setup_bot(shard: Optional[sharding.Shard] = None) -> master.Master:
 
     # Overwrite +1,+2,+3,ü4 emoji with custom ones
     pollutil.NUMBER_EMOJI_TO_VALUE = {
@@ -42,13 +74,19 @@ async def setup_bot() -> master.Master:
         ':x4:': 4,
     }
 
+    if c.TRACE_EXPORT:
+        tracing.init(tracing.create_exporter(c.TRACE_EXPORT), c.TRACE_SAMPLE_RATE)
+
     loop = asyncio.get_event_loop()
 
     masterbot = master.Master(c.SERVER, c.BOTNAME, c.PASSWORD, loop=loop)
     await masterbot.rest.login(c.BOTNAME, c.PASSWORD)
 
-    result = (await masterbot.rest.rooms_info(room_name=c.POLL_STATUS_ROOM)).json()
-    statusroom = m.create(m.Room, result['room'])
+    statusroom_info = rooms_cache.get(c.POLL_STATUS_ROOM)
+    if statusroom_info is None:
+        statusroom_info = (await masterbot.rest.rooms_info(room_name=c.POLL_STATUS_ROOM)).json()['room']
+        rooms_cache.set(c.POLL_STATUS_ROOM, statusroom_info)
+    statusroom = m.create(m.Room, statusroom_info)
     pollmanager = await pollutil.PollManager.create_pollmanager(
         master=masterbot, botname=c.BOTNAME, statusroom=statusroom.to_roomref())
 
@@ -57,10 +95,42 @@ async def setup_bot() -> master.Master:
     poll = com.Poll(master=masterbot, pollmanager=pollmanager)
     notify = com.CatchAll(master=masterbot, callback=com.private_message_user)
 
-    dms = com2.Dms(master=masterbot, token=c.DMS_TOKEN)
-    etm = com2.Etm(master=masterbot, pollmanager=pollmanager)
-    food = com2.Food(master=masterbot)
-    birthday = com2.Birthday(master=masterbot)
+    # All fsbot commands share the outbound queue to stay within the rate limit of the server.
+    # The rate limit applies to the bot user, so workers split it among each other
+    num_workers = shard.count if shard is not None else 1
+    sendqueue = sq.SendQueue(masterbot, rate=5.0 / num_workers)
+    # Each message and reaction of a poll action takes a token, also the poll updates outside of the queue
+    sendqueue.limit_ddp()
+    # Large payloads are processed in a pool such that they do not block other messages.
+    # Rendering the menu and filtering the users is pure python, so it runs in processes to not hold the GIL
+    processes = concurrent.futures.ProcessPoolExecutor(max_workers=2)
+    executor = ex.Executor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), pools={'menu': processes, 'users': processes})
+
+    com2.dms.create_config_if_missing(c.DMS_TOKEN)
+    dms = com2.Dms(
+        master=masterbot, sendqueue=sendqueue, executor=executor,
+        throttle=th.Throttle(*c.THROTTLE['dms']))
+    # Poll updates are sent to kafka in the background and spooled while the broker is unreachable
+    spool_file = c.KAFKA_SPOOL_FILE if shard is None else f'{c.KAFKA_SPOOL_FILE}.{shard.index}'
+    publisher = pub.KafkaPublisher(
+        RocketchatMensaProducer, spool=pub.Spool(spool_file), maxsize=c.KAFKA_QUEUE_SIZE)
+    publisher.start()
+
+    meals_provider = meals.MealsProvider(c.MENSA_CACHE_URL)
+
+    etm = com2.Etm(
+        master=masterbot, sendqueue=sendqueue, executor=executor, pollmanager=pollmanager,
+        meals_provider=meals_provider, publisher=publisher)
+    food = com2.Food(
+        master=masterbot, sendqueue=sendqueue, executor=executor, meals_provider=meals_provider,
+        throttle=th.Throttle(*c.THROTTLE['food']))
+    # Users are looked up in a directory which is updated by realtime events
+    users = UserDirectory(masterbot, users_cache)
+    users.attach()
+    birthday = com2.Birthday(
+        master=masterbot, sendqueue=sendqueue, executor=executor,
+        throttle=th.Throttle(*c.THROTTLE['birthday']), users=users)
 
     # Public command bot
     masterbot.bots.append(
@@ -82,11 +152,48 @@ async def setup_bot() -> master.Master:
             show_usage_on_unknown=False
         ))
 
+    if shard is not None:
+        shard.apply(masterbot, pollmanager)
+
+    for command in [usage, ping, poll, notify, dms, etm, food, birthday]:
+        tracing.instrument_command(command)
+    for bot in masterbot.bots:
+        tracing.instrument_bot(bot)
+    tracing.instrument_master(masterbot)
+
+    # On SIGTERM/SIGINT finish running commands and send pending messages before disconnecting
+    graceful = drain.Drain(masterbot, deadline=c.DRAIN_TIMEOUT, hook_time=c.DRAIN_HOOK_TIME)
+    # Hooks run in order, so the fast local ones go before the network flushes
+    graceful.add_hook(users.flush)
+    if shard is None or shard.index == 0:
+        # The caches are shared by all workers, so one snapshot is enough
+        graceful.add_hook(_save_snapshot)
+        graceful.run_in_background(snapshot.save_periodically(c.SNAPSHOT_FILE, caches, c.SNAPSHOT_INTERVAL))
+        # The menu broadcast runs once for all workers
+        if c.MENSA_BROADCAST_ROOMS:
+            at = datetime.datetime.strptime(c.MENSA_BROADCAST_TIME, '%H:%M').time()
+            graceful.run_in_background(broadcast.run_daily(
+                at, c.MENSA_BROADCAST_WEEKDAYS,
+                functools.partial(
+                    broadcast.broadcast_menu, masterbot, sendqueue, meals_provider, c.MENSA_BROADCAST_ROOMS, executor)))
+    graceful.add_hook(sendqueue.flush)
+    graceful.add_hook(publisher.flush)
+    graceful.add_hook(tracing.close)
+    graceful.run_in_background(metrics.report(600))
+    graceful.install(loop)
+
     return masterbot
 
 
-async def main() -> None:
-    masterbot = await setup_bot()
+async def _save_snapshot() -> None:
+    snapshot.save(c.SNAPSHOT_FILE, caches)
+
+
+async def main(shard: Optional[sharding.Shard] = None) -> None:
+    if shard is None:
+        # Start with the caches of the previous instance. Workers get them from the supervisor (see `init_stores`)
+        snapshot.load(c.SNAPSHOT_FILE, caches, max_age=c.SNAPSHOT_MAX_AGE)
+    masterbot = await setup_bot(shard)
 
     while True:
         try:
@@ -103,5 +210,31 @@ async def main() -> None:
             sentry.exception()
 
 
+def _bind_caches(stores: Dict[str, Any]) -> None:
+    meals.cache.bind(stores['menu'])
+    meals.responses.bind(stores['mensa_responses'])
+    users_cache.bind(stores['users'])
+    rooms_cache.bind(stores['rooms'])
+
+
+def init_stores(stores: Dict[str, Any]) -> None:
+    """Fill the shared stores from the snapshot once in the supervisor before the workers start
+
+    Loading in the workers would overwrite the live stores with stale entries whenever a worker restarts
+    """
+    _bind_caches(stores)
+    snapshot.load(c.SNAPSHOT_FILE, caches, max_age=c.SNAPSHOT_MAX_AGE)
+
+
+def run_worker(shard: sharding.Shard, stores: Dict[str, Any]) -> None:
+    """Entrypoint of a worker process in supervisor mode"""
+    _bind_caches(stores)
+    asyncio.run(main(shard))
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if c.WORKERS > 1:
+        # Supervisor mode: Distribute the rooms among multiple worker processes
+        sharding.supervise(c.WORKERS, run_worker, stores=list(caches), init=init_stores)
+    else:
+        asyncio.run(main())
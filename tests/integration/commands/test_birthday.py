@@ -6,12 +6,15 @@ import rocketbot.master as master
 import rocketbot.models as m
 
 import fsbot.commands as com
+from fsbot.utils.users import UserDirectory
 
 
 @pytest.yield_fixture
 async def birthdaybot(bot: master.Master) -> AsyncIterator[master.Master]:
     botname = bot._username
-    birthday = com.Birthday(master=bot)
+    users = UserDirectory(bot)
+    users.attach()
+    birthday = com.Birthday(master=bot, users=users)
 
     # Direct message bot
     bot.bots.append(
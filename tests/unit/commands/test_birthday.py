@@ -0,0 +1,53 @@
+import pytest
+from asynctest import CoroutineMock, MagicMock
+
+from fsbot.commands import birthday
+from fsbot.utils.models import UserEntry
+from fsbot.utils.users import UserDirectory
+
+
+def get_message(mentioned: str = 'bob') -> MagicMock:
+    message = MagicMock()
+    message.created_by.username = 'alice'
+    message.roomid = 'room'
+    message.mentions = [MagicMock(username=mentioned)]
+    message.mentions[0].name = None
+    return message
+
+
+@pytest.fixture
+def users(master: MagicMock) -> UserDirectory:
+    """Seeded directory with an inactive user"""
+    directory = UserDirectory(master)
+    directory.cache.set('users', [
+        UserEntry(id='id1', username='alice'),
+        UserEntry(id='id2', username='bob'),
+        UserEntry(id='id3', username='carol', active=False),
+    ])
+    return directory
+
+
+@pytest.mark.asyncio
+async def test_create_group_with_inactive_users(master: MagicMock, users: UserDirectory) -> None:
+    await users.seed()
+    master.rest.groups_create = CoroutineMock(return_value=MagicMock(status_code=200))
+    master.rest.groups_create.return_value.json.return_value = {
+        'group': {'_id': 'group', '_updatedAt': {'$date': 0}, 't': 'p'}}
+    master.rest.groups_add_owner = CoroutineMock()
+    command = birthday.Birthday(users=users, master=master)
+
+    await command.handle('birthday', '@bob', get_message())
+
+    master.rest.groups_create.assert_called_once_with(name='geburtstag_bob', members=['alice', 'carol'])
+
+
+@pytest.mark.asyncio
+async def test_reject_before_seeding(master: MagicMock, users: UserDirectory) -> None:
+    master.rest.groups_create = CoroutineMock()
+    command = birthday.Birthday(users=users, master=master)
+
+    await command.handle('birthday', '@bob', get_message())
+
+    master.rest.groups_create.assert_not_called()
+    master.ddp.send_message.assert_called_once_with(
+        'room', 'The user list is not loaded yet. Please try again later')
@@ -0,0 +1,42 @@
+from typing import Any
+
+import pytest
+from asynctest import CoroutineMock, MagicMock
+
+from fsbot.commands import dms
+
+
+def get_message(username: str = 'alice') -> MagicMock:
+    message = MagicMock()
+    message.created_by.username = username
+    message.roomid = 'room'
+    return message
+
+
+@pytest.mark.asyncio
+async def test_order_for_sender(master: MagicMock, dms_runner: CoroutineMock) -> None:
+    command = dms.Dms(runner=dms_runner, master=master)
+
+    await command.handle('order', 'mate', get_message())
+
+    dms_runner.assert_called_once_with(['order', 'mate', '--user=alice', '--force'])
+    master.ddp.send_message.assert_called_once_with('room', 'Done')
+
+
+@pytest.mark.asyncio
+async def test_keep_explicit_user(master: MagicMock, dms_runner: CoroutineMock) -> None:
+    command = dms.Dms(runner=dms_runner, master=master)
+
+    await command.handle('dms', 'buy mate --user=bob', get_message())
+
+    dms_runner.assert_called_once_with(['buy', 'mate', '--user=bob', '--force'])
+
+
+@pytest.mark.asyncio
+async def test_empty_output(master: MagicMock, dms_runner: Any) -> None:
+    dms_runner.return_value = b''
+    command = dms.Dms(runner=dms_runner, master=master)
+
+    await command.handle('drinks', 'list', get_message())
+
+    master.ddp.send_message.assert_called_once_with('room', 'Done.')
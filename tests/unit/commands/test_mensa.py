@@ -1,27 +1,16 @@
 # from typing import Any, Callable, List
 
 import datetime
-import pytest
-from asynctest import CoroutineMock, MagicMock
+from typing import Any, Dict, List, Optional, Tuple
 from unittest.mock import call
 
-from tests.utils import patch_module
-
+import pytest
+import rocketbot.utils.poll as pollutil
+from asynctest import CoroutineMock, MagicMock
 from rocketbot.models.rcdatetime import RcDatetime
-from fsbot.commands import mensa
-
 
-def setup_module() -> None:
-    fsbot_mock = MagicMock()
-    fsbot_mock.utils = MagicMock()
-    fsbot_mock.utils.meals = MagicMock()
-    fsbot_mock.utils.meals.get_food = CoroutineMock(return_value=None)
-    patch_module(
-        mensa,
-        {
-            'ftfbroker.producer.rocketchat_mensa': MagicMock(),
-            'fsbot.utils.meals': fsbot_mock,
-        })
+from fsbot.commands import mensa
+from fsbot.utils.throttle import Throttle
 
 
 def get_pollmanger(poll: MagicMock) -> MagicMock:
@@ -31,21 +20,32 @@ def get_pollmanger(poll: MagicMock) -> MagicMock:
     return pollmanager_mock
 
 
-def get_poll(days: int) -> MagicMock:
+def get_poll(days: int, options: List[str] = []) -> MagicMock:
     poll_mock = MagicMock()
     poll_mock.title = 'ETM'
     poll_mock.created_on = RcDatetime(datetime.datetime.now() - datetime.timedelta(days=days))
-    poll_mock.add_option = CoroutineMock()
+    poll_mock.options = [
+        pollutil.PollOption(text=o, emoji=pollutil.LETTER_EMOJIS[i], users=set(['bot']))
+        for i, o in enumerate(options)]
+
+    def _add_option(text: str) -> Optional[pollutil.PollOption]:
+        if any(o for o in poll_mock.options if o.text == text):
+            return None
+        option = pollutil.PollOption(text=text, emoji=pollutil.LETTER_EMOJIS[len(poll_mock.options)], users=set())
+        poll_mock.options.append(option)
+        return option
+
+    poll_mock.add_option = CoroutineMock(side_effect=_add_option)
     poll_mock.resend_old_message = CoroutineMock()
     return poll_mock
 
 
 @pytest.mark.asyncio
-async def test_should_create_new_poll_when_no_prev_poll_exists() -> None:
+async def test_should_create_new_poll_when_no_prev_poll_exists(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = MagicMock()
     pollmanager_mock.create = CoroutineMock()
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '', MagicMock())
@@ -55,10 +55,10 @@ async def test_should_create_new_poll_when_no_prev_poll_exists() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_create_new_poll_when_no_poll_from_today_exists() -> None:
+async def test_should_create_new_poll_when_no_poll_from_today_exists(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(1))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '', MagicMock())
@@ -68,10 +68,10 @@ async def test_should_create_new_poll_when_no_poll_from_today_exists() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_create_new_poll_with_11_30_for_etm() -> None:
+async def test_should_create_new_poll_with_11_30_for_etm(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(1))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '', MagicMock())
@@ -82,10 +82,10 @@ async def test_should_create_new_poll_with_11_30_for_etm() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_create_new_poll_with_12_30_for_etlm() -> None:
+async def test_should_create_new_poll_with_12_30_for_etlm(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(1))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etlm', '', MagicMock())
@@ -102,10 +102,10 @@ async def test_should_send_food_message_for_new_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_normalize_poll_options_for_new_poll() -> None:
+async def test_should_normalize_poll_options_for_new_poll(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(1))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '1200', MagicMock())
@@ -116,10 +116,10 @@ async def test_should_normalize_poll_options_for_new_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_split_poll_options_for_new_poll() -> None:
+async def test_should_split_poll_options_for_new_poll(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(1))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '"12:00" "13:00"', MagicMock())
@@ -130,10 +130,10 @@ async def test_should_split_poll_options_for_new_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_not_create_new_poll_when_one_exits_from_today() -> None:
+async def test_should_not_create_new_poll_when_one_exits_from_today(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     pollmanager_mock = get_pollmanger(get_poll(0))
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '', MagicMock())
@@ -143,11 +143,11 @@ async def test_should_not_create_new_poll_when_one_exits_from_today() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_add_new_option_to_existing_poll() -> None:
+async def test_should_add_new_option_to_existing_poll(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     poll_mock = get_poll(0)
     pollmanager_mock = get_pollmanger(poll_mock)
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '11:30', MagicMock())
@@ -166,11 +166,11 @@ async def test_should_preset_user_for_new_option_for_existing_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_normalize_poll_options_for_existing_poll() -> None:
+async def test_should_normalize_poll_options_for_existing_poll(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     poll_mock = get_poll(0)
     pollmanager_mock = get_pollmanger(poll_mock)
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '1200', MagicMock())
@@ -182,11 +182,11 @@ async def test_should_normalize_poll_options_for_existing_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_split_poll_options_for_existing_poll() -> None:
+async def test_should_split_poll_options_for_existing_poll(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     poll_mock = get_poll(0)
     pollmanager_mock = get_pollmanger(poll_mock)
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '"12:00" "13:00"', MagicMock())
@@ -198,11 +198,11 @@ async def test_should_split_poll_options_for_existing_poll() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_add_default_time_for_etm() -> None:
+async def test_should_add_default_time_for_etm(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     poll_mock = get_poll(0)
     pollmanager_mock = get_pollmanger(poll_mock)
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etm', '', MagicMock())
@@ -214,11 +214,11 @@ async def test_should_add_default_time_for_etm() -> None:
 
 
 @pytest.mark.asyncio
-async def test_should_add_default_time_for_etlm() -> None:
+async def test_should_add_default_time_for_etlm(command_kwargs: Dict[str, Any]) -> None:
     # Arrange
     poll_mock = get_poll(0)
     pollmanager_mock = get_pollmanger(poll_mock)
-    command = mensa.Etm(pollmanager=pollmanager_mock, master=MagicMock())
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
 
     # Act
     await command.handle('etlm', '', MagicMock())
@@ -227,3 +227,136 @@ async def test_should_add_default_time_for_etlm() -> None:
     actual = poll_mock.add_option.call_args
     expected = call('12:30')
     assert expected == actual
+
+
+@pytest.mark.asyncio
+async def test_should_keep_options_of_existing_poll_sorted_by_time(command_kwargs: Dict[str, Any]) -> None:
+    # Arrange
+    poll_mock = get_poll(0, ['11:30', '12:00'])
+    pollmanager_mock = get_pollmanger(poll_mock)
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
+
+    # Act
+    await command.handle('etm', '"13" "9:30" "mensa" "1145"', MagicMock())
+
+    # Assert
+    actual = [o.text for o in poll_mock.options]
+    assert actual == ['9:30', '11:30', '11:45', '12:00', '13:00', 'mensa']
+
+
+@pytest.mark.asyncio
+async def test_should_sort_options_of_poll_ordered_by_text(command_kwargs: Dict[str, Any]) -> None:
+    # Arrange
+    poll_mock = get_poll(0, ['13:00', '9:30'])
+    pollmanager_mock = get_pollmanger(poll_mock)
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
+
+    # Act
+    await command.handle('etm', '"12"', MagicMock())
+
+    # Assert
+    actual = [o.text for o in poll_mock.options]
+    assert actual == ['9:30', '12:00', '13:00']
+
+
+@pytest.mark.asyncio
+async def test_should_update_existing_poll_once_per_command(command_kwargs: Dict[str, Any]) -> None:
+    # Arrange
+    poll_mock = get_poll(0, ['11:30'])
+    pollmanager_mock = get_pollmanger(poll_mock)
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
+
+    # Act
+    await command.handle('etm', '"12:00" "12:30" "13:00"', MagicMock())
+
+    # Assert
+    poll_mock.resend_old_message.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_should_not_update_existing_poll_without_new_options(command_kwargs: Dict[str, Any]) -> None:
+    # Arrange
+    poll_mock = get_poll(0, ['11:30'])
+    pollmanager_mock = get_pollmanger(poll_mock)
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
+
+    # Act
+    await command.handle('etm', '11:30', MagicMock())
+
+    # Assert
+    poll_mock.resend_old_message.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_should_sort_options_for_new_poll(command_kwargs: Dict[str, Any]) -> None:
+    # Arrange
+    pollmanager_mock = get_pollmanger(get_poll(1))
+    command = mensa.Etm(pollmanager=pollmanager_mock, **command_kwargs)
+
+    # Act
+    await command.handle('etm', '"13:00" "12:00"', MagicMock())
+
+    # Assert
+    actual = pollmanager_mock.create.call_args[0][-1]
+    assert actual == ['12:00', '13:00']
+
+
+@pytest.mark.parametrize('args, today, expected', [
+    ('', 2, (0, 1)),
+    ('3', 2, (0, 3)),
+    ('Heute', 2, (0, 1)),
+    ('tomorrow', 2, (1, 1)),
+    ('übermorgen', 2, (2, 1)),
+    ('mittwoch', 2, (0, 1)),
+    ('mo', 2, (5, 1)),
+    ('Freitag', 0, (4, 1)),
+    ('mo-mi', 0, (0, 3)),
+    ('mo - mi', 2, (5, 3)),
+    ('do-mo', 2, (1, 5)),
+    ('heute bis fr', 1, (0, 4)),
+    ('nächste   Woche', 2, (5, 5)),
+    ('this week', 3, (0, 2)),
+    ('diese woche', 4, (0, 1)),
+    ('this week', 5, (2, 5)),
+    ('diese woche', 6, (1, 5)),
+    ('next week', 6, (1, 5)),
+    ('morgen-heute', 2, None),
+    ('mo-woche', 2, None),
+    ('essen', 2, None),
+])
+def test_parse_food_args(args: str, today: int, expected: Optional[Tuple[int, int]]) -> None:
+    assert mensa._parse_food_args(args, today) == expected
+
+
+@pytest.mark.asyncio
+async def test_should_reply_with_retry_time_when_food_is_throttled(
+        master: MagicMock, meals_provider: MagicMock) -> None:
+    # Arrange
+    sendqueue_mock = MagicMock()
+    sendqueue_mock.send_message = CoroutineMock()
+    command = mensa.Food(
+        master=master, sendqueue=sendqueue_mock, meals_provider=meals_provider, throttle=Throttle(1, 60))
+    message = MagicMock()
+
+    # Act
+    await command.handle('food', '', message)
+    await command.handle('food', 'morgen', message)
+
+    # Assert
+    assert sendqueue_mock.send_message.call_count == 2
+    actual = sendqueue_mock.send_message.call_args[0][1]
+    assert 'Too many requests' in actual
+
+
+def test_send_kafka_message_without_bot_votes() -> None:
+    options = [
+        pollutil.PollOption(text='11:30', emoji=pollutil.LETTER_EMOJIS[0], users=set(['bot', 'alice'])),
+        pollutil.PollOption(text='12:00', emoji=pollutil.LETTER_EMOJIS[1], users=set()),
+    ]
+    publisher = MagicMock()
+
+    mensa.send_kafka_message(options, 'bot', publisher)
+
+    # A snapshot which does not change with the poll
+    options[1].users.add('carol')
+    assert publisher.publish.call_args[0][0] == [('11:30', ('alice',)), ('12:00', ())]
@@ -0,0 +1,63 @@
+"""Fakes of the external dependencies of the commands
+
+The commands get all external dependencies injected, so the unit tests build
+fakes here instead of patching imports.
+"""
+from typing import Any, Dict
+
+import pytest
+from asynctest import CoroutineMock, MagicMock
+
+import fsbot.utils.meals as meals
+import fsbot.utils.sendqueue as sq
+from fsbot.utils.cache import TTLCache
+from fsbot.utils.publisher import KafkaPublisher
+
+MENSA_URL = 'https://www.mensa_dummy.de/api'
+
+
+@pytest.fixture
+def master() -> MagicMock:
+    """Master without bots whose coroutines can be awaited. Sent messages are returned as text"""
+    master_mock = MagicMock()
+    for call in sq.LIMITED_CALLS:
+        setattr(master_mock.ddp, call, CoroutineMock())
+    master_mock.ddp.send_message.side_effect = lambda roomid, msg: msg
+    master_mock.ddp.client.subscribe = CoroutineMock()
+    master_mock.ddp.subscription_tasks = []
+    master_mock.rest.users_list = CoroutineMock()
+    master_mock.room = CoroutineMock()
+    master_mock.finish_all_tasks = CoroutineMock()
+    master_mock.shutdown = CoroutineMock()
+    master_mock.bots = []
+    return master_mock
+
+
+@pytest.fixture
+def meals_provider() -> MagicMock:
+    """Meals provider without menu"""
+    provider_mock = MagicMock(spec=meals.MealsProvider)
+    provider_mock.get_food = CoroutineMock(return_value=f'```\n{meals.NO_MEALS}\n```')
+    return provider_mock
+
+
+@pytest.fixture
+def mensa() -> meals.MealsProvider:
+    """Real meals provider with empty caches. Requests have to be faked via `aiohttp.ClientSession.get`"""
+    return meals.MealsProvider(MENSA_URL, cache=TTLCache(ttl=600), responses=TTLCache(ttl=600))
+
+
+@pytest.fixture
+def publisher() -> MagicMock:
+    return MagicMock(spec=KafkaPublisher)
+
+
+@pytest.fixture
+def dms_runner() -> CoroutineMock:
+    return CoroutineMock(return_value=b'Done')
+
+
+@pytest.fixture
+def command_kwargs(master: MagicMock, meals_provider: MagicMock, publisher: MagicMock) -> Dict[str, Any]:
+    """Dependencies of the mensa commands"""
+    return {'master': master, 'meals_provider': meals_provider, 'publisher': publisher}
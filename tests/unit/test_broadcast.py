@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+from typing import Any
+
+import pytest
+import rocketbot.exception as exp
+from asynctest import MagicMock
+
+import fsbot.utils.broadcast as broadcast
+import fsbot.utils.sendqueue as sq
+
+
+async def get_room(room_name: str) -> MagicMock:
+    if room_name == 'unknown':
+        raise exp.RocketBotException('Room not found')
+    return MagicMock(_id=f'{room_name}_id')
+
+
+@pytest.mark.asyncio
+async def test_broadcast_renders_once_and_sends_to_all_rooms(master: MagicMock, meals_provider: MagicMock) -> None:
+    meals_provider.get_food.return_value = '```\nMeal: 1\n```'
+    master.room.side_effect = get_room
+    sendqueue = sq.SendQueue(master)
+
+    count = await broadcast.broadcast_menu(master, sendqueue, meals_provider, ['a', 'unknown', 'b'])
+
+    assert count == 2
+    meals_provider.get_food.assert_called_once()
+    actual = [call[0] for call in master.ddp.send_message.call_args_list]
+    assert actual == [('a_id', '```\nMeal: 1\n```'), ('b_id', '```\nMeal: 1\n```')]
+
+
+@pytest.mark.asyncio
+async def test_no_broadcast_without_meals(master: MagicMock, meals_provider: MagicMock) -> None:
+    meals_provider.get_food.return_value = '```\nNo meals received.\n```'
+    master.room.side_effect = get_room
+    sendqueue = sq.SendQueue(master)
+
+    count = await broadcast.broadcast_menu(master, sendqueue, meals_provider, ['a'])
+
+    assert count == 0
+    master.ddp.send_message.assert_not_called()
+
+
+@pytest.mark.parametrize('now, expected', [
+    # Monday before and after the broadcast
+    (datetime.datetime(2020, 1, 6, 9, 0), datetime.datetime(2020, 1, 6, 10, 30)),
+    (datetime.datetime(2020, 1, 6, 10, 30), datetime.datetime(2020, 1, 7, 10, 30)),
+    # Friday after the broadcast and saturday -> monday
+    (datetime.datetime(2020, 1, 10, 11, 0), datetime.datetime(2020, 1, 13, 10, 30)),
+    (datetime.datetime(2020, 1, 11, 9, 0), datetime.datetime(2020, 1, 13, 10, 30)),
+])
+def test_next_run(now: datetime.datetime, expected: datetime.datetime) -> None:
+    assert broadcast.next_run(now, datetime.time(10, 30), [0, 1, 2, 3, 4]) == expected
+
+
+@pytest.mark.asyncio
+async def test_run_daily_can_be_canceled_while_running(monkeypatch: Any) -> None:
+    started = asyncio.Event()
+
+    async def _broadcast() -> None:
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(broadcast, 'next_run', lambda now, at, weekdays: now)
+    task = asyncio.ensure_future(broadcast.run_daily(datetime.time(10, 30), [0], _broadcast))
+    await asyncio.wait_for(started.wait(), 1)
+    task.cancel()
+    await asyncio.wait([task], timeout=1)
+
+    assert task.cancelled()
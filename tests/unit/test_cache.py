@@ -0,0 +1,35 @@
+import multiprocessing
+import time
+
+from fsbot.utils.cache import TTLCache
+
+
+def test_get_and_set() -> None:
+    cache = TTLCache(ttl=60)
+    cache.set('key', 'value')
+
+    assert cache.get('key') == 'value'
+    assert cache.get('other') is None
+
+
+def test_expired_entry() -> None:
+    cache = TTLCache(ttl=0.01)
+    cache.set('key', 'value')
+    time.sleep(0.02)
+
+    assert cache.get('key') is None
+    assert 'key' not in cache.store
+
+
+def test_bind_shared_store() -> None:
+    cache = TTLCache(ttl=60)
+    cache.set('key', 'value')
+
+    with multiprocessing.Manager() as manager:
+        store = manager.dict()
+        cache.bind(store)
+        other = TTLCache(ttl=60, store=store)
+        other.set('other', 'value2')
+
+        assert other.get('key') == 'value'
+        assert cache.get('other') == 'value2'
@@ -0,0 +1,120 @@
+import asyncio
+import signal
+from typing import Any, List
+
+import pytest
+from asynctest import CoroutineMock, MagicMock
+
+import fsbot.utils.drain as drain
+
+
+def add_bot(master: MagicMock) -> MagicMock:
+    bot_mock = MagicMock()
+    bot_mock.handle = CoroutineMock()
+    master.bots.append(bot_mock)
+    return bot_mock
+
+
+@pytest.mark.asyncio
+async def test_ignore_new_messages_while_draining(master: MagicMock) -> None:
+    bot_handle = add_bot(master).handle
+    graceful = drain.Drain(master, deadline=1)
+    graceful.install(asyncio.get_event_loop())
+
+    await master.bots[0].handle(MagicMock())
+    await graceful.shutdown(signal.SIGTERM)
+    await master.bots[0].handle(MagicMock())
+
+    bot_handle.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_hooks_after_handlers_and_before_disconnect(master: MagicMock) -> None:
+    order: List[str] = []
+    master.finish_all_tasks.side_effect = lambda: order.append('handlers')
+    master.shutdown.side_effect = lambda: order.append('shutdown')
+    graceful = drain.Drain(master, deadline=1)
+    graceful.add_hook(CoroutineMock(side_effect=lambda: order.append('hook')))
+
+    await graceful.shutdown(signal.SIGTERM)
+
+    assert order == ['handlers', 'hook', 'shutdown']
+
+
+@pytest.mark.asyncio
+async def test_stop_waiting_for_handlers_after_deadline(master: MagicMock) -> None:
+    master.finish_all_tasks.side_effect = lambda: asyncio.sleep(10)
+    hook = CoroutineMock()
+    graceful = drain.Drain(master, deadline=0.05, hook_time=0.04)
+    graceful.add_hook(hook)
+
+    await graceful.shutdown(signal.SIGTERM)
+
+    hook.assert_called_once()
+    master.shutdown.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_skip_remaining_hooks_after_deadline(master: MagicMock) -> None:
+    loop = asyncio.get_event_loop()
+    later_hook = CoroutineMock()
+    graceful = drain.Drain(master, deadline=0.05, hook_time=0.04)
+    graceful.add_hook(CoroutineMock(side_effect=lambda: asyncio.sleep(10)))
+    graceful.add_hook(later_hook)
+
+    start = loop.time()
+    await graceful.shutdown(signal.SIGTERM)
+
+    assert loop.time() - start < 1
+    later_hook.assert_not_called()
+    master.shutdown.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_failing_hook_does_not_prevent_shutdown(master: MagicMock) -> None:
+    graceful = drain.Drain(master, deadline=1)
+    graceful.add_hook(CoroutineMock(side_effect=RuntimeError('failed')))
+
+    await graceful.shutdown(signal.SIGTERM)
+
+    master.shutdown.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_cancel_background_tasks_on_shutdown(master: MagicMock) -> None:
+    graceful = drain.Drain(master, deadline=1)
+    task = graceful.run_in_background(asyncio.sleep(10))
+
+    await graceful.shutdown(signal.SIGTERM)
+    await asyncio.wait([task])
+
+    assert task.cancelled()
+    assert graceful._tasks == []
+
+
+@pytest.mark.asyncio
+async def test_log_failing_background_task(master: MagicMock, caplog: Any) -> None:
+    graceful = drain.Drain(master, deadline=1)
+
+    async def _fail() -> None:
+        raise RuntimeError('failed')
+
+    task = graceful.run_in_background(_fail())
+    await asyncio.wait([task])
+    await asyncio.sleep(0)
+
+    assert 'Background task failed: RuntimeError: failed' in caplog.text
+    assert graceful._tasks == []
+
+
+@pytest.mark.asyncio
+async def test_shutdown_on_signal(master: MagicMock) -> None:
+    graceful = drain.Drain(master, deadline=1)
+    graceful.run_in_background(asyncio.sleep(10))
+
+    graceful._on_signal(signal.SIGTERM)
+    graceful._on_signal(signal.SIGINT)
+    assert graceful._shutdown is not None
+    await graceful._shutdown
+
+    master.shutdown.assert_called_once()
@@ -0,0 +1,61 @@
+import concurrent.futures
+import os
+import threading
+
+import pytest
+
+import fsbot.utils.executor as ex
+import fsbot.utils.metrics as metrics
+
+
+def setup_function() -> None:
+    metrics.reset()
+
+
+def current_thread() -> int:
+    return threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_run_small_work_inline() -> None:
+    executor = ex.Executor(thresholds={'menu': 10})
+
+    thread = await executor.run('menu', 9, current_thread)
+
+    assert thread == threading.get_ident()
+    assert metrics.snapshot()['executor.menu.inline'] == 1
+
+
+@pytest.mark.asyncio
+async def test_run_large_work_in_pool() -> None:
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        executor = ex.Executor(pool, thresholds={'menu': 10})
+
+        thread = await executor.run('menu', 10, current_thread)
+
+    assert thread != threading.get_ident()
+    snapshot = metrics.snapshot()
+    assert snapshot['executor.menu.offloaded'] == 1
+    assert snapshot['executor.menu.seconds.count'] == 1
+    assert snapshot['executor.pending'] == 0
+
+
+@pytest.mark.asyncio
+async def test_run_kind_in_own_pool() -> None:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1) as processes:
+        executor = ex.Executor(thresholds={'menu': 0}, pools={'menu': processes})
+
+        pid = await executor.run('menu', 1, os.getpid)
+        thread = await executor.run('dms', 1, current_thread)
+
+    assert pid != os.getpid()
+    assert thread != threading.get_ident()
+
+
+@pytest.mark.asyncio
+async def test_run_passes_exception() -> None:
+    executor = ex.Executor(thresholds={'menu': 0})
+
+    with pytest.raises(ZeroDivisionError):
+        await executor.run('menu', 1, divmod, 1, 0)
+    assert metrics.snapshot()['executor.pending'] == 0
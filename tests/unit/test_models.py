@@ -0,0 +1,76 @@
+import copy
+import tracemalloc
+from typing import Any, Callable, Dict
+
+import rocketbot.models as m
+import rocketbot.utils.poll as pollutil
+
+from fsbot.utils.models import OptionVotes, UserEntry
+
+
+def get_user_dict(i: int) -> Dict[str, Any]:
+    return {
+        '_id': f'id{i}', 'username': f'user{i}', 'name': f'User {i}',
+        'active': True, 'status': 'offline', 'type': 'user',
+    }
+
+
+def allocated(create: Callable[[], Any]) -> int:
+    """Bytes which are still allocated by the result of `create`"""
+    tracemalloc.start()
+    try:
+        result = create()  # noqa: F841
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size
+
+
+def test_user_entry_conversion() -> None:
+    user = m.create(m.User, get_user_dict(1))
+    entry = UserEntry.from_user(user)
+
+    assert entry == UserEntry(id='id1', username='user1', name='User 1')
+    assert entry == UserEntry.from_dict(get_user_dict(1))
+    assert entry.to_userref() == m.UserRef(_id='id1', username='user1', name='User 1')
+    assert UserEntry.from_user(entry.to_userref()) == entry
+
+
+def test_option_votes_conversion() -> None:
+    option = pollutil.PollOption(text='11:30', emoji=':a:', users={'bot', 'alice'})
+    votes = OptionVotes.from_option(option, exclude='bot')
+
+    assert votes == OptionVotes('11:30', ['alice'])
+    assert len(votes) == 1
+    assert votes.as_tuple() == ('11:30', ('alice',))
+    assert votes.to_option(':a:') == pollutil.PollOption(text='11:30', emoji=':a:', users={'alice'})
+    assert sorted(OptionVotes.from_option(option).voters) == ['alice', 'bot']
+    # A copy which does not change with the option
+    option.users.add('carol')
+    assert len(votes) == 1
+
+
+def test_benchmark_memory_of_50k_users() -> None:
+    data = [get_user_dict(i) for i in range(50000)]
+
+    models = allocated(lambda: [m.create(m.User, u) for u in data])
+    entries = allocated(lambda: [UserEntry.from_dict(u) for u in data])
+
+    # m.User: about 16MB, UserEntry: about 4.8MB
+    assert entries < models / 2
+    assert entries / len(data) < 120
+
+
+def test_benchmark_memory_of_large_poll() -> None:
+    users = [f'user{i}' for i in range(200)]
+    options = [
+        pollutil.PollOption(text=f'{11 + i // 60}:{i % 60:02}', emoji=f':{i}:', users=set(users + ['bot']))
+        for i in range(500)]
+
+    # Copies of the options: about 4.4MB, OptionVotes: about 0.86MB
+    copies = allocated(lambda: copy.deepcopy(options))
+    votes = allocated(lambda: [OptionVotes.from_option(o, exclude='bot') for o in options])
+
+    assert votes < copies / 4
+    # Not much more than a pointer per voter
+    assert votes / (500 * 200) < 10
@@ -0,0 +1,137 @@
+import asyncio
+from typing import Any, List
+
+import pytest
+
+import fsbot.utils.metrics as metrics
+from fsbot.utils.publisher import KafkaPublisher, Spool, Update
+
+
+class Broker:
+    """Local stand-in of the kafka broker which can be taken down"""
+    def __init__(self) -> None:
+        self.up = True
+        self.received: List[Update] = []
+
+    def producer(self) -> 'Producer':
+        if not self.up:
+            raise ConnectionError('NoBrokersAvailable')
+        return Producer(self)
+
+
+class Producer:
+    def __init__(self, broker: Broker):
+        self.broker = broker
+        self.pending: List[Any] = []
+
+    def sendV1(self, options: Any) -> None:
+        self.pending.append([(t, list(u)) for t, u in options])
+
+    def flush(self) -> None:
+        if not self.broker.up:
+            raise ConnectionError('KafkaTimeoutError')
+        self.broker.received.extend(self.pending)
+        self.pending = []
+
+    def close(self) -> None:
+        pass
+
+
+def update(i: int) -> Update:
+    return [(f'11:{i:02}', [f'user{i}'])]
+
+
+async def wait_for(condition: Any) -> None:
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('Condition not met')
+
+
+def setup_function() -> None:
+    metrics.reset()
+
+
+@pytest.mark.asyncio
+async def test_publish_in_background() -> None:
+    broker = Broker()
+    publisher = KafkaPublisher(broker.producer)
+
+    publisher.publish(update(1))
+    publisher.publish(update(2))
+    await publisher.flush()
+
+    assert broker.received == [update(1), update(2)]
+    assert metrics.snapshot()['kafka.sent'] == 2
+
+
+@pytest.mark.asyncio
+async def test_spool_while_broker_is_down_and_replay_in_order(tmp_path: Any) -> None:
+    broker = Broker()
+    broker.up = False
+    spool = Spool(str(tmp_path / 'kafka.spool'))
+    publisher = KafkaPublisher(broker.producer, spool=spool, retry_interval=0.05)
+
+    for i in range(3):
+        publisher.publish(update(i))
+    # The first update goes to the spool, the others wait in the queue for the replay
+    await wait_for(lambda: len(spool) == 1)
+    assert broker.received == []
+    assert metrics.snapshot()['kafka.spool'] == 1
+
+    broker.up = True
+    publisher.publish(update(3))
+    await wait_for(lambda: len(broker.received) == 4)
+
+    assert broker.received == [update(i) for i in range(4)]
+    assert len(spool) == 0
+    assert not (tmp_path / 'kafka.spool').exists()
+    await publisher.flush()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_goes_to_spool() -> None:
+    broker = Broker()
+    broker.up = False
+    publisher = KafkaPublisher(broker.producer, maxsize=2)
+
+    for i in range(5):
+        publisher.publish(update(i))
+
+    # The queue was moved to the spool before the background task got the first update
+    assert publisher.spool.read() == [update(i) for i in range(3)]
+    assert metrics.snapshot()['kafka.queue.full'] == 1
+    await publisher.flush()
+    assert publisher.spool.read() == [update(i) for i in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_replay_spool_of_last_run(tmp_path: Any) -> None:
+    path = str(tmp_path / 'kafka.spool')
+    Spool(path).append([update(1), update(2)])
+    broker = Broker()
+    publisher = KafkaPublisher(broker.producer, spool=Spool(path))
+
+    publisher.start()
+    publisher.publish(update(3))
+    await wait_for(lambda: len(broker.received) == 3)
+
+    assert broker.received == [update(1), update(2), update(3)]
+    await publisher.flush()
+
+
+@pytest.mark.asyncio
+async def test_flush_spools_on_deadline(tmp_path: Any) -> None:
+    broker = Broker()
+    broker.up = False
+    spool = Spool(str(tmp_path / 'kafka.spool'))
+    publisher = KafkaPublisher(broker.producer, spool=spool, retry_interval=10)
+    publisher.publish(update(1))
+    await wait_for(lambda: len(spool) == 1)
+    publisher.publish(update(2))
+
+    await asyncio.wait_for(publisher.flush(), 1)
+
+    # Json turns the (text, voters) tuples into lists
+    assert Spool(spool.path).read() == [[list(o) for o in update(i)] for i in (1, 2)]
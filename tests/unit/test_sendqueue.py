@@ -0,0 +1,142 @@
+import asyncio
+from typing import List
+
+import pytest
+from asynctest import MagicMock
+
+import fsbot.utils.sendqueue as sq
+
+
+@pytest.mark.asyncio
+async def test_send_message(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+
+    result = await sendqueue.send_message('room', 'hello')
+
+    assert result == 'hello'
+    master.ddp.send_message.assert_called_once_with('room', 'hello')
+
+
+@pytest.mark.asyncio
+async def test_merge_consecutive_messages_of_same_room(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+
+    await asyncio.gather(
+        sendqueue.send_message('room1', 'a'),
+        sendqueue.send_message('room1', 'b'),
+        sendqueue.send_message('room2', 'c'),
+        sendqueue.send_message('room1', 'd'))
+
+    actual = [call[0] for call in master.ddp.send_message.call_args_list]
+    assert actual == [('room1', 'a\nb\nd'), ('room2', 'c')]
+
+
+@pytest.mark.asyncio
+async def test_do_not_merge_messages_which_are_sent_already(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+
+    await sendqueue.send_message('room1', 'a')
+    await sendqueue.send_message('room1', 'b')
+
+    actual = [call[0] for call in master.ddp.send_message.call_args_list]
+    assert actual == [('room1', 'a'), ('room1', 'b')]
+
+
+@pytest.mark.asyncio
+async def test_replies_before_updates_of_same_room(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+    order: List[str] = []
+
+    async def _update() -> None:
+        order.append('update')
+
+    async def _reply() -> None:
+        order.append('reply')
+
+    await asyncio.gather(
+        sendqueue.submit('room1', _update),
+        sendqueue.submit('room1', _update),
+        sendqueue.submit('room1', _reply, priority=sq.Priority.REPLY))
+
+    assert order == ['reply', 'update', 'update']
+
+
+@pytest.mark.asyncio
+async def test_replies_get_tokens_before_updates(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master, rate=100, burst=1)
+    # Use up the burst, so all messages wait for a token
+    await sendqueue.send_message('room0', 'first')
+
+    await asyncio.gather(
+        sendqueue.send_message('room1', 'a', priority=sq.Priority.UPDATE),
+        sendqueue.send_message('room2', 'b', priority=sq.Priority.UPDATE),
+        sendqueue.send_message('room3', 'c'))
+
+    actual = [call[0][1] for call in master.ddp.send_message.call_args_list]
+    assert actual == ['first', 'c', 'a', 'b']
+
+
+@pytest.mark.asyncio
+async def test_slow_action_does_not_delay_other_rooms(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+    resume = asyncio.Event()
+
+    async def _slow_update() -> None:
+        # e.g. Poll.resend_old_message sleeps for a second
+        await resume.wait()
+
+    update = asyncio.ensure_future(sendqueue.submit('room1', _slow_update))
+    await asyncio.wait_for(sendqueue.send_message('room2', 'hello'), 0.5)
+
+    assert not update.done()
+    resume.set()
+    await update
+
+
+@pytest.mark.asyncio
+async def test_each_call_of_an_action_takes_a_token(master: MagicMock) -> None:
+    sendqueue = sq.SendQueue(master)
+    ddp_mock = master.ddp
+    set_reaction = ddp_mock.set_reaction
+    sendqueue.limit_ddp()
+    acquired: List[sq.Priority] = []
+
+    async def _acquire(priority: sq.Priority) -> None:
+        acquired.append(priority)
+
+    setattr(sendqueue._bucket, 'acquire', _acquire)
+
+    async def _create_poll() -> None:
+        await ddp_mock.send_message('room1', 'poll')
+        for reaction in [':a:', ':b:']:
+            await ddp_mock.set_reaction(reaction, 'msg_id', True)
+
+    await sendqueue.submit('room1', _create_poll, priority=sq.Priority.REPLY)
+    # Outside of the queue (e.g. poll updates triggered by reactions)
+    await ddp_mock.set_reaction(':c:', 'msg_id', True)
+
+    assert acquired == [sq.Priority.REPLY] * 3 + [sq.Priority.UPDATE]
+    assert set_reaction.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_exception_is_passed_to_sender(master: MagicMock) -> None:
+    master.ddp.send_message.side_effect = RuntimeError('failed')
+    sendqueue = sq.SendQueue(master)
+
+    with pytest.raises(RuntimeError):
+        await sendqueue.send_message('room', 'hello')
+    assert len(sendqueue) == 0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate() -> None:
+    loop = asyncio.get_event_loop()
+    bucket = sq.TokenBucket(rate=100, capacity=2)
+
+    start = loop.time()
+    for _ in range(4):
+        await bucket.acquire()
+
+    # Two tokens are available immediately, the other two take 10ms each
+    assert loop.time() - start >= 0.015
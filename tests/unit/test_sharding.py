@@ -0,0 +1,64 @@
+import pytest
+import rocketbot.bots as bots
+import rocketbot.utils.poll as pollutil
+from asynctest import CoroutineMock, MagicMock
+
+import fsbot.utils.sharding as sharding
+
+
+def get_message(roomid: str) -> MagicMock:
+    message = MagicMock()
+    message.roomid = roomid
+    return message
+
+
+def test_each_room_is_owned_by_exactly_one_shard() -> None:
+    shards = [sharding.Shard(i, 3) for i in range(3)]
+    roomids = [f'room{i}' for i in range(100)]
+
+    for roomid in roomids:
+        assert sum(shard.owns(roomid) for shard in shards) == 1
+    # All shards get some rooms
+    assert all(any(shard.owns(roomid) for roomid in roomids) for shard in shards)
+
+
+@pytest.mark.asyncio
+async def test_apply_restricts_command_bots_to_own_rooms(master: MagicMock) -> None:
+    shard = sharding.Shard(0, 2)
+    own = next(f'room{i}' for i in range(100) if shard.owns(f'room{i}'))
+    other = next(f'room{i}' for i in range(100) if not shard.owns(f'room{i}'))
+
+    commandbot = MagicMock()
+    commandbot_handle = commandbot.handle = CoroutineMock()
+    pollmanager = MagicMock()
+    pollmanager.polls = pollutil.PollCache()
+    pollbot_handle = pollmanager.roomBot.handle
+    master.bots = [commandbot, pollmanager.roomBot]
+
+    shard.apply(master, pollmanager)
+    await commandbot.handle(get_message(own))
+    await commandbot.handle(get_message(other))
+
+    commandbot_handle.assert_called_once()
+    assert commandbot_handle.call_args[0][0].roomid == own
+    # The poll bot is left untouched
+    assert pollmanager.roomBot.handle is pollbot_handle
+
+
+def test_apply_drops_polls_of_other_shards(master: MagicMock) -> None:
+    shard = sharding.Shard(0, 2)
+    roomids = [f'room{i}' for i in range(10)]
+    pollmanager = MagicMock()
+    pollmanager.polls = pollutil.PollCache()
+    for i, roomid in enumerate(roomids):
+        poll = pollutil.Poll(
+            id=f'poll{i}', roomid=roomid, original_msg_id=f'orig{i}', botname='bot', title='ETM', vote_options=[])
+        poll._poll_msg_id = f'msg{i}'
+        poll._status_msg_id = f'status{i}'
+        pollmanager.polls.add(poll)
+    master.bots = [MagicMock(spec=bots.RoomCustomBot)]
+
+    shard.apply(master, pollmanager)
+
+    actual = sorted(p.roomid for p in pollmanager.polls.by_id.values())
+    assert actual == sorted(r for r in roomids if shard.owns(r))
@@ -0,0 +1,83 @@
+import asyncio
+import struct
+import threading
+import time
+from typing import Any, List
+
+import pytest
+
+import fsbot.utils.snapshot as snapshot
+from fsbot.utils.cache import TTLCache
+
+
+def test_save_and_load(tmp_path: Any) -> None:
+    path = str(tmp_path / 'cache.snapshot')
+    menu = TTLCache(ttl=60)
+    menu.set('key', 'value')
+    snapshot.save(path, {'menu': menu})
+
+    new_menu = TTLCache(ttl=60)
+    assert snapshot.load(path, {'menu': new_menu, 'users': TTLCache(ttl=60)}, max_age=60)
+
+    assert new_menu.get('key') == 'value'
+
+
+def test_load_missing_file(tmp_path: Any) -> None:
+    assert not snapshot.load(str(tmp_path / 'missing'), {'menu': TTLCache(ttl=60)}, max_age=60)
+
+
+def test_load_corrupt_file(tmp_path: Any) -> None:
+    path = tmp_path / 'cache.snapshot'
+    path.write_bytes(b'garbage')
+
+    assert not snapshot.load(str(path), {'menu': TTLCache(ttl=60)}, max_age=60)
+
+
+def test_ignore_outdated_snapshot(tmp_path: Any) -> None:
+    path = str(tmp_path / 'cache.snapshot')
+    snapshot.save(path, {'menu': TTLCache(ttl=60)})
+    time.sleep(0.02)
+
+    assert not snapshot.load(path, {'menu': TTLCache(ttl=60)}, max_age=0.01)
+
+
+def test_ignore_snapshot_of_other_version(tmp_path: Any) -> None:
+    path = tmp_path / 'cache.snapshot'
+    snapshot.save(str(path), {'menu': TTLCache(ttl=60)})
+    data = bytearray(path.read_bytes())
+    struct.pack_into('>H', data, 8, snapshot.VERSION + 1)
+    path.write_bytes(bytes(data))
+
+    assert not snapshot.load(str(path), {'menu': TTLCache(ttl=60)}, max_age=60)
+
+
+@pytest.mark.asyncio
+async def test_pickle_on_loop_and_write_in_thread(tmp_path: Any, monkeypatch: Any) -> None:
+    path = str(tmp_path / 'cache.snapshot')
+    menu = TTLCache(ttl=60)
+    menu.set('key', 'value')
+    threads: List[str] = []
+    dump, write = snapshot.dump, snapshot.write
+    written = asyncio.Event()
+    loop = asyncio.get_event_loop()
+
+    def _dump(*args: Any) -> bytes:
+        threads.append(f'dump:{threading.current_thread() is threading.main_thread()}')
+        return dump(*args)
+
+    def _write(*args: Any) -> None:
+        threads.append(f'write:{threading.current_thread() is threading.main_thread()}')
+        write(*args)
+        loop.call_soon_threadsafe(written.set)
+
+    monkeypatch.setattr(snapshot, 'dump', _dump)
+    monkeypatch.setattr(snapshot, 'write', _write)
+    task = asyncio.ensure_future(snapshot.save_periodically(path, {'menu': menu}, interval=0.01))
+    await asyncio.wait_for(written.wait(), 1)
+    task.cancel()
+    await asyncio.wait([task])
+
+    assert threads[:2] == ['dump:True', 'write:False']
+    new_menu = TTLCache(ttl=60)
+    assert snapshot.load(path, {'menu': new_menu}, max_age=60)
+    assert new_menu.get('key') == 'value'
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from asynctest import CoroutineMock
+
+import fsbot.utils.throttle as th
+
+
+@pytest.mark.asyncio
+async def test_run_within_limit() -> None:
+    throttle = th.Throttle(limit=2, window=60)
+    func = CoroutineMock()
+
+    assert await throttle.run('user', 1, func) is None
+    assert await throttle.run('user', 2, func) is None
+    assert func.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_reject_when_limit_is_exceeded() -> None:
+    throttle = th.Throttle(limit=1, window=60)
+    func = CoroutineMock()
+
+    await throttle.run('user', 1, func)
+    retry_in = await throttle.run('user', 2, func)
+
+    assert retry_in is not None
+    assert 0 < retry_in <= 60
+    func.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_limit_per_user() -> None:
+    throttle = th.Throttle(limit=1, window=60)
+    func = CoroutineMock()
+
+    assert await throttle.run('user1', 1, func) is None
+    assert await throttle.run('user2', 1, func) is None
+    assert func.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_window_slides() -> None:
+    throttle = th.Throttle(limit=1, window=0.01)
+    func = CoroutineMock()
+
+    await throttle.run('user', 1, func)
+    await asyncio.sleep(0.02)
+
+    assert await throttle.run('user', 2, func) is None
+    assert func.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_forget_users_without_requests_in_window() -> None:
+    throttle = th.Throttle(limit=1, window=0.01)
+    func = CoroutineMock()
+
+    await throttle.run('user1', 1, func)
+    await throttle.run('user2', 1, func)
+    await asyncio.sleep(0.02)
+    await throttle.run('user3', 1, func)
+
+    assert list(throttle._requests_by_user) == ['user3']
+
+
+@pytest.mark.asyncio
+async def test_deduplicate_in_flight_requests() -> None:
+    throttle = th.Throttle(limit=1, window=60)
+    func = CoroutineMock(side_effect=lambda: asyncio.sleep(0.01))
+
+    results = await asyncio.gather(throttle.run('user', 1, func), throttle.run('user', 1, func))
+
+    assert results == [None, None]
+    func.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_do_not_deduplicate_if_disabled() -> None:
+    throttle = th.Throttle(limit=2, window=60)
+    func = CoroutineMock(side_effect=lambda: asyncio.sleep(0.01))
+
+    await asyncio.gather(throttle.run('user', 1, func, False), throttle.run('user', 1, func, False))
+
+    assert func.call_count == 2
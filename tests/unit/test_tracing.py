@@ -0,0 +1,164 @@
+import datetime
+import json
+from typing import Any, Iterator, List
+
+import pytest
+import rocketbot.models as m
+from asynctest import CoroutineMock, MagicMock
+
+import fsbot.utils.tracing as tracing
+
+
+class ListExporter(tracing.Exporter):
+    def __init__(self) -> None:
+        self.spans: List[tracing.Span] = []
+
+    def export(self, spans: List[tracing.Span]) -> None:
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter() -> Iterator[ListExporter]:
+    exporter = ListExporter()
+    tracing.init(exporter)
+    yield exporter
+    tracing._tracer = None
+
+
+def test_export_trace_when_root_span_finishes(exporter: ListExporter) -> None:
+    with tracing.trace('message', message_id='1') as root:
+        with tracing.span('child'):
+            with tracing.span('grandchild'):
+                pass
+        assert exporter.spans == []
+
+    assert root is not None
+    assert [s.name for s in exporter.spans] == ['grandchild', 'child', 'message']
+    assert all(s.trace_id == root.trace_id for s in exporter.spans)
+    grandchild, child, _ = exporter.spans
+    assert child.parent_id == root.span_id
+    assert grandchild.parent_id == child.span_id
+
+
+def test_span_with_explicit_parent(exporter: ListExporter) -> None:
+    with tracing.trace('message') as root:
+        pass
+    tracing.detach()
+
+    assert root is not None
+    with tracing.span('late', parent=root):
+        pass
+
+    assert exporter.spans[-1].name == 'late'
+    assert exporter.spans[-1].parent_id == root.span_id
+
+
+def test_no_span_without_trace(exporter: ListExporter) -> None:
+    with tracing.span('child') as s:
+        assert s is None
+    assert exporter.spans == []
+
+
+def test_no_span_when_not_sampled(exporter: ListExporter) -> None:
+    tracing.init(exporter, sample_rate=0)
+
+    with tracing.trace('message') as root:
+        with tracing.span('child') as child:
+            assert tracing.current_span() is None
+
+    assert root is None
+    assert child is None
+    assert exporter.spans == []
+
+
+def test_no_trace_when_disabled() -> None:
+    with tracing.trace('message') as root:
+        assert root is None
+
+
+def test_record_error(exporter: ListExporter) -> None:
+    with pytest.raises(ValueError):
+        with tracing.trace('message'):
+            raise ValueError('failed')
+
+    assert exporter.spans[0].attributes['error'] == 'ValueError: failed'
+
+
+def test_jsonl_exporter(tmp_path: Any) -> None:
+    path = str(tmp_path / 'traces.jsonl')
+    tracing.init(tracing.create_exporter(path))
+    try:
+        with tracing.trace('message'):
+            with tracing.span('child', command='Food'):
+                pass
+    finally:
+        tracing._tracer = None
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['name'] for line in lines] == ['child', 'message']
+    assert lines[0]['attributes'] == {'command': 'Food'}
+
+
+def test_otlp_format() -> None:
+    exporter = tracing.OtlpExporter('http://localhost:4318/v1/traces')
+    span = tracing.Span('message', 'a' * 16, None, {'room_id': 'room'})
+    span.end = span.start + 1
+
+    data = exporter.to_otlp([span])
+
+    otlp_span = data['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert otlp_span['traceId'] == '0' * 16 + 'a' * 16
+    assert otlp_span['name'] == 'message'
+    assert otlp_span['attributes'] == [{'key': 'room_id', 'value': {'stringValue': 'room'}}]
+
+
+@pytest.mark.asyncio
+async def test_otlp_exporter_reuses_session() -> None:
+    exporter = tracing.OtlpExporter('http://localhost:4318/v1/traces')
+    session = MagicMock()
+    session.post.return_value.__aenter__ = CoroutineMock(return_value=MagicMock(status=200))
+    session.post.return_value.__aexit__ = CoroutineMock(return_value=False)
+    session.close = CoroutineMock()
+    exporter._session = session
+    span = tracing.Span('message', 'a' * 16, None, {})
+
+    exporter.export([span])
+    exporter.export([span])
+    assert len(exporter._tasks) == 2
+    await exporter.close()
+
+    assert session.post.call_count == 2
+    session.close.assert_called_once()
+    assert exporter._tasks == set()
+    assert exporter._session is None
+
+
+@pytest.mark.asyncio
+async def test_instrument_master_records_receive_latency(exporter: ListExporter) -> None:
+    masterbot = MagicMock()
+    subscribe = masterbot.ddp.subscribe_my_messages = CoroutineMock()
+    tracing.instrument_master(masterbot)
+    await masterbot.ddp.subscribe_my_messages(CoroutineMock())
+    result = MagicMock()
+    result.message.created_at = m.RcDatetime(datetime.datetime.now() - datetime.timedelta(seconds=2))
+
+    await subscribe.call_args[0][0](result)
+
+    assert exporter.spans[0].name == 'message'
+    assert 2000 <= exporter.spans[0].attributes['receive_latency_ms'] < 3000
+
+
+@pytest.mark.asyncio
+async def test_instrument_command(exporter: ListExporter) -> None:
+    command = MagicMock()
+    command.can_handle.return_value = True
+    command.handle = CoroutineMock()
+    tracing.instrument_command(command)
+
+    with tracing.trace('message'):
+        assert command.can_handle('food')
+        await command.handle('food', '', MagicMock())
+
+    assert [s.name for s in exporter.spans] == ['can_handle', 'command', 'message']
+    assert exporter.spans[0].attributes['result'] is True
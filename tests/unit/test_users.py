@@ -0,0 +1,121 @@
+import asyncio
+from typing import Any
+
+import pytest
+from asynctest import CoroutineMock, MagicMock
+from ddp_asyncio.collection import Collection
+
+from fsbot.utils.cache import TTLCache
+from fsbot.utils.models import UserEntry
+from fsbot.utils.users import UserDirectory
+
+
+@pytest.fixture
+def master(master: MagicMock) -> MagicMock:
+    """Master of a server with two users and a bot"""
+    master.rest.users_list.return_value.json.return_value = {
+        'users': [
+            {'_id': 'id1', 'username': 'alice', 'name': 'Alice', 'active': True},
+            {'_id': 'id2', 'username': 'bob', 'name': 'Bob', 'active': False},
+            {'_id': 'id3', 'name': 'Rocket.Cat'},
+        ],
+    }
+    master.ddp.client.get_collection.return_value = Collection('stream-notify-logged')
+    return master
+
+
+@pytest.mark.asyncio
+async def test_seed(master: MagicMock) -> None:
+    users = UserDirectory(master)
+    await users.seed()
+
+    assert len(users) == 2
+    assert users.get('alice') == UserEntry(id='id1', username='alice', name='Alice')
+    assert users.get_by_id('id2') == UserEntry(id='id2', username='bob', name='Bob', active=False)
+    assert users.usernames() == ['alice']
+    assert users.usernames(active_only=False) == ['alice', 'bob']
+
+
+@pytest.mark.asyncio
+async def test_seed_from_cache(master: MagicMock) -> None:
+    cache = TTLCache(ttl=60)
+    cache.set('users', [UserEntry(id='id1', username='alice')])
+    users = UserDirectory(master, cache)
+    await users.seed()
+
+    assert 'alice' in users
+    master.rest.users_list.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_apply_events(master: MagicMock) -> None:
+    users = UserDirectory(master)
+    await users.seed()
+    bob = users.get('bob')
+
+    users.apply('user-status', [['id1', 'alice', 1, '']])
+    users.apply('user-status', [['id4', 'carol', 2, '']])
+    users.apply('Users:NameChanged', [{'_id': 'id1', 'username': 'alice2', 'name': 'Alice Two'}])
+    users.apply('Users:Deleted', [{'userId': 'id2'}])
+
+    assert users.get('alice') is None
+    assert users.get('alice2') == UserEntry(id='id1', username='alice2', name='Alice Two', status='online')
+    assert users.get('carol') == UserEntry(id='id4', username='carol', status='away')
+    assert 'bob' not in users
+    # The changes are written to the cache at once
+    assert bob in (users.cache.get('users') or [])
+    await users.flush()
+    assert sorted(u.username for u in users.cache.get('users') or []) == ['alice2', 'carol']
+
+
+@pytest.mark.asyncio
+async def test_start_consumes_stream(master: MagicMock) -> None:
+    users = UserDirectory(master)
+    await users.start()
+
+    assert master.ddp.client.subscribe.call_count == 3
+    task = users._task
+    assert task is not None and task in master.ddp.subscription_tasks
+
+    collection = master.ddp.client.get_collection.return_value
+    collection.__changed__('id', {'eventName': 'Users:Deleted', 'args': [{'userId': 'id1'}]}, None)
+    await asyncio.sleep(0)
+
+    assert 'alice' not in users
+    task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_replay_events_received_while_seeding(master: MagicMock) -> None:
+    users = UserDirectory(master)
+    collection = master.ddp.client.get_collection.return_value
+
+    async def _users_list(**kwargs: Any) -> MagicMock:
+        # The stream delivers a change while the users are downloaded
+        collection.__changed__('id', {'eventName': 'Users:Deleted', 'args': [{'userId': 'id1'}]}, None)
+        await asyncio.sleep(0)
+        return users_list
+
+    users_list = master.rest.users_list.return_value
+    master.rest.users_list = _users_list
+    await users.start()
+
+    assert 'alice' not in users
+    assert 'bob' in users
+    assert users._pending is None
+    assert users._task is not None
+    users._task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_attach_starts_on_connect(master: MagicMock) -> None:
+    enable_bots = master.enable_bots = CoroutineMock()
+    users = UserDirectory(master)
+    users.attach()
+
+    await master.enable_bots()
+
+    enable_bots.assert_called_once()
+    assert len(users) == 2
+    for task in master.ddp.subscription_tasks:
+        task.cancel()
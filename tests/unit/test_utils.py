@@ -1,11 +1,11 @@
-from typing import Any, Callable, List
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List
 
 import pytest
-from asynctest import CoroutineMock, MagicMock, patch
+from asynctest import MagicMock, patch
 
 import fsbot.utils.meals as meals
-
-from tests.utils import patch_module
+import fsbot.utils.metrics as metrics
 
 MEAL_DATA = [
     ("day 1", [{"meals": ["Kichererbsenpolenta"]}, {"meals": ["Schweinesteak"]}]),
@@ -14,47 +14,59 @@ MEAL_DATA = [
 ]
 
 
-def setup_module() -> None:
-    mock_bot_config = MagicMock()
-    mock_bot_config.MENSA_CACHE_URL = 'https://www.mensa_dummy.de/api'
-    patch_module(meals, {'bot_config': mock_bot_config})
+def setup_function() -> None:
+    metrics.reset()
+
+
+def mock_response(
+        data: Any, status: int = 200, headers: Dict[str, str] = {},
+        chunk_size: int = 7, received: List[bytes] = []) -> MagicMock:
+    body = json.dumps(data, ensure_ascii=False, indent=1).encode()
+
+    async def _iter_chunked(size: int) -> AsyncIterator[bytes]:
+        for i in range(0, len(body), chunk_size):
+            received.append(body[i:i + chunk_size])
+            yield body[i:i + chunk_size]
 
+    res = MagicMock()
+    res.__aenter__.return_value.status = status
+    res.__aenter__.return_value.headers = headers
+    res.__aenter__.return_value.content.iter_chunked = _iter_chunked
+    return res
 
-def mock_get_meals(data: List[Any]) -> Callable[[str], MagicMock]:
-    def _mock(url: str) -> MagicMock:
-        res = MagicMock()
+
+def mock_get_meals(data: List[Any], headers: Dict[str, str] = {}) -> Callable[..., MagicMock]:
+    def _mock(url: str, **kwargs: Any) -> MagicMock:
         num_meals = int(url.split('/')[-1])
-        res.__aenter__.return_value.json = CoroutineMock(
-            return_value={d[0]: d[1] for d in data[0:num_meals] if d is not None})
-        return res
+        return mock_response({d[0]: d[1] for d in data[0:num_meals] if d is not None}, headers=headers)
     return _mock
 
 
 @pytest.mark.asyncio
 @patch('aiohttp.ClientSession.get')
-async def test_get_food_empty_result(mock_get: MagicMock) -> None:
-    mock_get.return_value.__aenter__.return_value.json = CoroutineMock(return_value={})
+async def test_get_food_empty_result(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    mock_get.return_value = mock_response({})
 
-    result = await meals.get_food(0, 1)
+    result = await mensa.get_food(0, 1)
     assert 'No meals' in result
 
 
 @pytest.mark.asyncio
 @patch('aiohttp.ClientSession.get')
-async def test_get_food_today(mock_get: MagicMock) -> None:
+async def test_get_food_today(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
     mock_get.side_effect = mock_get_meals(MEAL_DATA)
 
-    result = await meals.get_food(0, 1)
+    result = await mensa.get_food(0, 1)
     assert 'day 1' in result
     assert 'Kichererbsenpolenta' in result
 
 
 @pytest.mark.asyncio
 @patch('aiohttp.ClientSession.get')
-async def test_get_food_tomorrow(mock_get: MagicMock) -> None:
+async def test_get_food_tomorrow(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
     mock_get.side_effect = mock_get_meals(MEAL_DATA)
 
-    result = await meals.get_food(1, 1)
+    result = await mensa.get_food(1, 1)
     assert 'day 1' not in result
     assert 'day 2' in result
     assert 'Eieromelette' in result
@@ -62,10 +74,10 @@ async def test_get_food_tomorrow(mock_get: MagicMock) -> None:
 
 @pytest.mark.asyncio
 @patch('aiohttp.ClientSession.get')
-async def test_get_food_next_two_days(mock_get: MagicMock) -> None:
+async def test_get_food_next_two_days(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
     mock_get.side_effect = mock_get_meals(MEAL_DATA)
 
-    result = await meals.get_food(0, 2)
+    result = await mensa.get_food(0, 2)
     assert 'day 1' in result
     assert 'Kichererbsenpolenta' in result
     assert 'day 2' in result
@@ -74,7 +86,7 @@ async def test_get_food_next_two_days(mock_get: MagicMock) -> None:
 
 @pytest.mark.asyncio
 @patch('aiohttp.ClientSession.get')
-async def test_get_food_next_week(mock_get: MagicMock) -> None:
+async def test_get_food_next_week(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
     """If there is no meal on a day (e.g weekend), then there will be no result for that day
     This means the result data is shorter than the requested size (but we don't know which data
     are missing)
@@ -87,6 +99,118 @@ async def test_get_food_next_week(mock_get: MagicMock) -> None:
     """
     mock_get.side_effect = mock_get_meals([None, None, *MEAL_DATA])
 
-    result = await meals.get_food(2, 1)
+    result = await mensa.get_food(2, 1)
     assert 'day 1' in result
     assert 'Kichererbsenpolenta' in result
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_cached(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    mock_get.side_effect = mock_get_meals(MEAL_DATA)
+
+    first = await mensa.get_food(0, 1)
+    second = await mensa.get_food(0, 1)
+
+    assert first == second
+    # Nothing is fetched for the days before today
+    assert mock_get.call_count == 1
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_conditional_request(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    mock_get.side_effect = mock_get_meals(MEAL_DATA, headers={'ETag': '"v1"'})
+    first = await mensa.get_food(0, 1)
+
+    # The menu did not change, but the rendered menu is not cached anymore
+    mensa.cache.store.clear()
+    mock_get.side_effect = lambda url, **kwargs: mock_response(None, status=304)
+    second = await mensa.get_food(0, 1)
+
+    assert first == second
+    assert mock_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+    assert metrics.snapshot()['mensa.http.not_modified'] == 1
+    assert metrics.snapshot()['mensa.http.bytes_saved'] > 0
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_not_modified_without_stored_response(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    responses = [mock_response(None, status=304), mock_get_meals(MEAL_DATA)('/1')]
+    mock_get.side_effect = lambda url, **kwargs: responses.pop(0)
+
+    result = await mensa.get_food(0, 1)
+
+    assert 'Kichererbsenpolenta' in result
+    # The second request is not conditional
+    assert 'If-None-Match' not in mock_get.call_args_list[1][1]['headers']
+    assert mock_get.call_args_list[1][1]['headers']['Cache-Control'] == 'no-cache'
+    assert metrics.snapshot()['mensa.http.not_modified_without_data'] == 1
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_compressed(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    mock_get.side_effect = mock_get_meals(MEAL_DATA, headers={'Content-Encoding': 'gzip', 'Content-Length': '10'})
+
+    await mensa.get_food(0, 1)
+
+    assert mock_get.call_args[1]['headers']['Accept-Encoding'] == 'gzip, deflate'
+    # The whole body was read, so the compressed size is known
+    assert metrics.snapshot()['mensa.http.bytes'] == 10
+    assert metrics.snapshot()['mensa.http.bytes_saved'] > 0
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_stops_reading_after_requested_days(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    days = {f'day {i}': [{'meals': [f'Meal {i}' * 100]}] for i in range(1, 300)}
+    received: List[bytes] = []
+    mock_get.return_value = mock_response(days, chunk_size=meals.CHUNK_SIZE, received=received)
+
+    result = await mensa.get_food(0, 1)
+
+    assert 'Meal 1' in result
+    assert 'Meal 2' not in result
+    body_size = len(json.dumps(days, indent=1).encode())
+    assert body_size > 10 * meals.CHUNK_SIZE
+    # Only the first chunk is read
+    assert len(received) == 1
+    assert metrics.snapshot()['mensa.http.bytes'] == meals.CHUNK_SIZE
+
+
+@pytest.mark.asyncio
+@patch('aiohttp.ClientSession.get')
+async def test_get_food_max_payload_size(mock_get: MagicMock, mensa: meals.MealsProvider) -> None:
+    huge = [("day 1", [{"meals": ["x" * 1000]}] * 2000)]
+    mock_get.side_effect = lambda url, **kwargs: mock_response(
+        {d[0]: d[1] for d in huge}, chunk_size=meals.CHUNK_SIZE)
+
+    result = await mensa.get_food(0, 1)
+    # The result is cached although it is empty, so the large response is not fetched again
+    assert await mensa.get_food(0, 1) == result
+
+    assert 'No meals' in result
+    assert mock_get.call_count == 1
+    assert metrics.snapshot()['mensa.http.too_large'] == 1
+
+
+def test_days_decoder() -> None:
+    body = '{"tag 1": [{"meals": ["Gemüse"]}], "tag 2" : [1, 2],"tag 3":{}}'.encode()
+    for chunk_size in [1, 3, len(body)]:
+        decoder = meals._DaysDecoder()
+        entries = []
+        for i in range(0, len(body), chunk_size):
+            entries += decoder.feed(body[i:i + chunk_size])
+
+        assert entries == [('tag 1', [{'meals': ['Gemüse']}]), ('tag 2', [1, 2]), ('tag 3', {})]
+        assert decoder.done
+
+
+def test_days_decoder_incomplete() -> None:
+    decoder = meals._DaysDecoder()
+    decoder.feed(b'{"tag 1": [1')
+
+    with pytest.raises(json.JSONDecodeError):
+        decoder.close()